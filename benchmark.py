@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the hot paths of SmartFormat for Python.
+
+Run all benchmarks::
+
+   $ python benchmark.py
+
+Save the results as a baseline and compare with it after a change::
+
+   $ python benchmark.py --save baseline.json
+   $ python benchmark.py --compare baseline.json
+
+"""
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import fnmatch
+import gc
+import json
+import sys
+import timeit
+
+from smartformat import SmartFormatter
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """Registers a benchmark.  The decorated function sets up a workload and
+    returns a function to be measured.
+    """
+    def decorator(f):
+        BENCHMARKS[name] = f
+        return f
+    return decorator
+
+
+class Gender(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+MALE, FEMALE = Gender('male'), Gender('female')
+
+
+@benchmark('parse')
+def parse():
+    smart = SmartFormatter('en_US', cache_size=0)
+    format_string = u'{0} got {1:an item|{} items} from {2:{}|, |, and }.'
+    return lambda: smart.compile(format_string)
+
+
+@benchmark('plain')
+def plain():
+    smart = SmartFormatter('en_US')
+    return lambda: smart.format(u'Hello, {0}!', u'world')
+
+
+@benchmark('literal')
+def literal():
+    smart = SmartFormatter('en_US')
+    return lambda: smart.format(u'Hello, world!')
+
+
+def numeric(spec, locales):
+    formatters = [SmartFormatter(locale) for locale in locales]
+    format_string = u'{0:%s}' % spec
+
+    def run():
+        for smart in formatters:
+            smart.format(format_string, 1234567.891)
+    return run
+
+
+LOCALES = ['en_US', 'fr_FR', 'hi_IN', 'ja_JP']
+
+
+@benchmark('numeric.n2')
+def numeric_n2():
+    return numeric(u'n2', LOCALES)
+
+
+@benchmark('numeric.c')
+def numeric_c():
+    return numeric(u'c', LOCALES)
+
+
+@benchmark('numeric.local')
+def numeric_local():
+    return numeric(u',.2f', LOCALES)
+
+
+def plural(locale, format_string):
+    smart = SmartFormatter(locale)
+
+    def run():
+        for n in (0, 1, 2, 5, 11, 21, 102, 1005):
+            smart.format(format_string, n)
+    return run
+
+
+@benchmark('plural.en')
+def plural_en():
+    return plural('en_US', u'{0} {0:item|items}')
+
+
+@benchmark('plural.ru')
+def plural_ru():
+    return plural('ru_RU', u'{0} {0:банан|банана|бананов}')
+
+
+@benchmark('plural.ar')
+def plural_ar():
+    return plural('ar', u'{0} {0:a|b|c|d|e|f}')
+
+
+@benchmark('choose')
+def choose():
+    smart = SmartFormatter('en_US')
+    format_string = u'{0:choose(male|female):He|She} came.'
+
+    def run():
+        smart.format(format_string, MALE)
+        smart.format(format_string, FEMALE)
+    return run
+
+
+@benchmark('list')
+def list_():
+    smart = SmartFormatter('en_US')
+    format_string = u'{0:{:n2}|, |, and }'
+    value = [x * 1.5 for x in range(10)]
+    return lambda: smart.format(format_string, value)
+
+
+def error_action(errors):
+    smart = SmartFormatter('en_US', errors=errors)
+    format_string = u'{0} {0:__:} {1:item|items}'
+    return lambda: smart.format(format_string, 1, 2)
+
+
+@benchmark('errors.ignore')
+def errors_ignore():
+    return error_action('ignore')
+
+
+@benchmark('errors.skip')
+def errors_skip():
+    return error_action('skip')
+
+
+def measure(run, min_time=0.2, repeat=3):
+    """Measures a function.  Returns operations per second and the peak
+    memory allocated by an operation in bytes.
+    """
+    run()
+    timer = timeit.Timer(run)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    best = min(timer.repeat(repeat, number))
+    ops = number / best
+    if tracemalloc is None:
+        return ops, None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, __ = tracemalloc.get_traced_memory()
+        run()
+        __, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return ops, peak - before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('patterns', nargs='*', metavar='PATTERN',
+                        help='run only benchmarks matching the patterns')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown ratio to be a regression '
+                             '(default: %(default)s)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds of a measurement')
+    args = parser.parse_args(argv)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    results = OrderedDict()
+    regressions = []
+    for name, setup in BENCHMARKS.items():
+        if args.patterns and \
+           not any(fnmatch.fnmatch(name, p) for p in args.patterns):
+            continue
+        ops, alloc = measure(setup(), args.min_time)
+        results[name] = {'ops': ops, 'alloc': alloc}
+        line = '%-16s %12.1f ops/s' % (name, ops)
+        if alloc is not None:
+            line += ' %10d B/op' % alloc
+        if name in baseline:
+            ratio = ops / baseline[name]['ops']
+            line += ' %+7.1f%%' % ((ratio - 1) * 100)
+            if ratio < 1 - args.threshold:
+                line += ' REGRESSION'
+                regressions.append(name)
+        print(line)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
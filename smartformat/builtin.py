@@ -10,19 +10,96 @@
 
 """
 import decimal
-import io
+from numbers import Number
 
 from babel import Locale
-from six import string_types
+from six import integer_types, string_types
 
 from .smart import default_extensions, extension
-from .utils import get_plural_tag_index
+from .utils import get_plural_tag_index, LRUCache
 
 
 __all__ = ['choose', 'conditional', 'list_', 'plural']
 
 
-@extension(['plural', 'p', ''])
+_missing = object()
+
+
+#: Split words by format strings.
+words_cache = LRUCache(1024)
+
+
+def split_words(format, maxsplit=-1):
+    """Splits a format string into words by `|`.  The result is cached."""
+    key = (format, maxsplit)
+    words = words_cache.get(key)
+    if words is None:
+        words = tuple(format.split(u'|', maxsplit))
+        words_cache.set(key, words)
+    return words
+
+
+def eval_prepared(prepare, formatter, value, name, option, format):
+    """Prepares an extension and evaluates it at once."""
+    prepared = prepare(formatter, name, option, format)
+    if prepared is not None:
+        return prepared(formatter, value)
+
+
+def prepared_branches(select):
+    """Makes a prepared extension which renders a branch template selected by
+    `select(formatter, value)`.  If `select` returns ``None``, the extension
+    passes the value.  The prepared extension can also stream the branch.
+    Branches without replacement fields are returned without rendering.
+    """
+    def prepared(formatter, value):
+        template = select(formatter, value)
+        if template is None:
+            return
+        elif template.literal is not None:
+            return template.literal
+        return formatter.vrender(template, (value,), {})
+
+    def stream(formatter, value):
+        template = select(formatter, value)
+        if template is None:
+            return
+        elif template.literal is not None:
+            return (template.literal,)
+        return formatter.ivrender(template, (value,), {})
+    prepared.stream = stream
+    return prepared
+
+
+def prepare_plural(formatter, name, option, format):
+    # Extract the plural words from the format string.
+    words = split_words(format)
+    # This extension requires at least two plural words.
+    if not name and len(words) == 1:
+        return
+    templates = [formatter.compile(word) for word in words]
+    # Get the locale.
+    locale = Locale.parse(option) if option else None
+
+    def select(formatter, value):
+        # This extension only formats numbers.
+        if isinstance(value, integer_types):
+            number = value
+        elif isinstance(value, float) and value.is_integer():
+            number = int(value)
+        else:
+            try:
+                number = decimal.Decimal(value)
+            except (TypeError, ValueError, decimal.InvalidOperation):
+                return
+        # Select word based on the plural tag index.
+        index = get_plural_tag_index(number, locale or formatter.locale)
+        return templates[index]
+    return prepared_branches(select)
+
+
+@extension(['plural', 'p', ''], prepare=prepare_plural,
+           types=(Number,) + string_types, pure=True)
 def plural(formatter, value, name, option, format):
     """Chooses different textension for locale-specific pluralization rules.
 
@@ -36,21 +113,8 @@ def plural(formatter, value, name, option, format):
        There are 10 items.
 
     """
-    # Extract the plural words from the format string.
-    words = format.split('|')
-    # This extension requires at least two plural words.
-    if not name and len(words) == 1:
-        return
-    # This extension only formats numbers.
-    try:
-        number = decimal.Decimal(value)
-    except (ValueError, decimal.InvalidOperation):
-        return
-    # Get the locale.
-    locale = Locale.parse(option) if option else formatter.locale
-    # Select word based on the plural tag index.
-    index = get_plural_tag_index(number, locale)
-    return formatter.format(words[index], value)
+    return eval_prepared(prepare_plural, formatter, value,
+                         name, option, format)
 
 
 def get_choice(value):
@@ -63,7 +127,35 @@ def get_choice(value):
     return str(value)
 
 
-@extension(['choose', 'c'])
+def prepare_choose(formatter, name, option, format):
+    if not option:
+        return
+    words = split_words(format)
+    num_words = len(words)
+    if num_words < 2:
+        return
+    choices = split_words(option)
+    num_choices = len(choices)
+    # If the words has 1 more item than the choices, the last word will be
+    # used as a default choice.
+    if num_words not in (num_choices, num_choices + 1):
+        n = num_choices
+        raise ValueError('specify %d or %d choices' % (n, n + 1))
+    templates = [formatter.compile(word) for word in words]
+
+    def select(formatter, value):
+        choice = get_choice(value)
+        try:
+            index = choices.index(choice)
+        except ValueError:
+            if num_words == num_choices:
+                raise ValueError('no default choice supplied')
+            index = -1
+        return templates[index]
+    return prepared_branches(select)
+
+
+@extension(['choose', 'c'], prepare=prepare_choose, pure=True)
 def choose(formatter, value, name, option, format):
     """Adds simple logic to format strings.
 
@@ -77,30 +169,11 @@ def choose(formatter, value, name, option, format):
        u'other'
 
     """
-    if not option:
-        return
-    words = format.split('|')
-    num_words = len(words)
-    if num_words < 2:
-        return
-    choices = option.split('|')
-    num_choices = len(choices)
-    # If the words has 1 more item than the choices, the last word will be
-    # used as a default choice.
-    if num_words not in (num_choices, num_choices + 1):
-        n = num_choices
-        raise ValueError('specify %d or %d choices' % (n, n + 1))
-    choice = get_choice(value)
-    try:
-        index = choices.index(choice)
-    except ValueError:
-        if num_words == num_choices:
-            raise ValueError('no default choice supplied')
-        index = -1
-    return formatter.format(words[index], value)
+    return eval_prepared(prepare_choose, formatter, value,
+                         name, option, format)
 
 
-@extension(['conditional', 'cond'])
+@extension(['conditional', 'cond'], pure=True)
 def conditional(formatter, value, name, option, format):
     """SmartFormat for Python doesn't implement it because SmartFormat.NET has
     deprecated the 'conditional' extension.
@@ -108,52 +181,82 @@ def conditional(formatter, value, name, option, format):
     raise NotImplementedError('obsolete extension: conditional')
 
 
-@extension(['list', 'l', ''])
-def list_(formatter, value, name, option, format):
-    """Repeats the items of an array.
-
-    Spec: `{:[l[ist]:]item|spacer[|final_spacer[|two_spacer]]}`
-
-    Example::
-
-       >>> fruits = [u'apple', u'banana', u'coconut']
-       >>> smart.format(u'{fruits:list:{}|, |, and | and }', fruits=fruits)
-       u'apple, banana, and coconut'
-       >>> smart.format(u'{fruits:list:{}|, |, and | and }', fruits=fruits[:2])
-       u'apple and banana'
-
-    """
+def prepare_list(formatter, name, option, format):
     if not format:
         return
-    if not hasattr(value, '__getitem__') or isinstance(value, string_types):
-        return
-    words = format.split(u'|', 4)
+    words = split_words(format, 4)
     num_words = len(words)
     if num_words < 2:
         # Require at least two words for item format and spacer.
         return
-    num_items = len(value)
-    item_format = words[0]
     # NOTE: SmartFormat.NET treats a not nested item format as the format
     # string to format each items.  For example, `x` will be treated as `{:x}`.
     # But the original tells us this behavior has been deprecated so that
     # should be removed.  So SmartFormat for Python doesn't implement the
     # behavior.
+    item_template = formatter.compile(words[0])
     spacer = u'' if num_words < 2 else words[1]
     final_spacer = spacer if num_words < 3 else words[2]
     two_spacer = final_spacer if num_words < 4 else words[3]
-    buf = io.StringIO()
-    for x, item in enumerate(value):
-        if x == 0:
-            pass
-        elif x < num_items - 1:
-            buf.write(spacer)
-        elif x == 1:
-            buf.write(two_spacer)
-        else:
-            buf.write(final_spacer)
-        buf.write(formatter.format(item_format, item, index=x))
-    return buf.getvalue()
+
+    def stream(formatter, value):
+        if isinstance(value, string_types):
+            return
+        try:
+            items = iter(value)
+        except TypeError:
+            return
+        return iter_list(formatter, items)
+
+    def iter_item(formatter, item, x):
+        return formatter.ivrender(item_template, (item,), {'index': x})
+
+    def iter_list(formatter, value):
+        # Look ahead one item to find the last item without `len()`.
+        x, prev_item = -1, _missing
+        for item in value:
+            if prev_item is not _missing:
+                if x != 0:
+                    yield spacer
+                for chunk in iter_item(formatter, prev_item, x):
+                    yield chunk
+            x, prev_item = x + 1, item
+        if prev_item is _missing:
+            return
+        if x == 1:
+            yield two_spacer
+        elif x != 0:
+            yield final_spacer
+        for chunk in iter_item(formatter, prev_item, x):
+            yield chunk
+
+    def list_(formatter, value):
+        chunks = stream(formatter, value)
+        if chunks is not None:
+            return u''.join(chunks)
+    list_.stream = stream
+    return list_
+
+
+# Not restricted by types because sequences without `__iter__` are also
+# iterable.  The prepared extension passes non-iterable values.
+@extension(['list', 'l', ''], prepare=prepare_list, pure=True)
+def list_(formatter, value, name, option, format):
+    """Repeats the items of an iterable.  Lazy iterables such as generators
+    are consumed item by item.
+
+    Spec: `{:[l[ist]:]item|spacer[|final_spacer[|two_spacer]]}`
+
+    Example::
+
+       >>> fruits = [u'apple', u'banana', u'coconut']
+       >>> smart.format(u'{fruits:list:{}|, |, and | and }', fruits=fruits)
+       u'apple, banana, and coconut'
+       >>> smart.format(u'{fruits:list:{}|, |, and | and }', fruits=fruits[:2])
+       u'apple and banana'
+
+    """
+    return eval_prepared(prepare_list, formatter, value, name, option, format)
 
 
 # Register to the default extensions registry.
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+   smartformat.bulk
+   ~~~~~~~~~~~~~~~~
+
+   Formats many numbers by a .NET format spec at once.  It is useful to
+   export large arrays of numbers such as NumPy arrays.
+
+   :copyright: (c) 2016 by What! Studio
+   :license: BSD, see LICENSE for more details.
+
+"""
+from babel.numbers import LC_NUMERIC
+
+from .dotnet import get_field_renderer
+from .utils import parse_locale
+
+
+__all__ = ['format_numbers', 'get_number_renderer']
+
+
+def iter_values(values):
+    """Iterates values in a sequence or a buffer.  Integer and 64-bit float
+    arrays are converted to Python numbers in bulk by `tolist()`.
+    """
+    dtype = getattr(values, 'dtype', None)
+    if dtype is None:
+        if hasattr(values, 'tolist'):
+            # array.array or memoryview.
+            return values.tolist()
+        return values
+    if dtype.kind in 'iu' or (dtype.kind == 'f' and dtype.itemsize == 8):
+        return values.tolist()
+    # The string representations of the other scalars are different from
+    # Python numbers.  Keep them.
+    return values
+
+
+def get_number_renderer(format_spec, locale=LC_NUMERIC):
+    """Makes a function which renders a number same with
+    :meth:`DotNetFormatter.format_field`.  The locale symbols and the number
+    pattern are resolved only once.
+    """
+    locale = parse_locale(locale) or LC_NUMERIC
+    return get_field_renderer(format_spec, locale)
+
+
+def format_numbers(format_spec, values, locale=LC_NUMERIC):
+    """Formats numbers by a .NET format spec such as ``n2``, ``p1`` or ``d6``.
+    `values` may be any iterable of numbers including NumPy arrays and
+    buffers.  Returns a list of strings::
+
+       >>> format_numbers(u'n2', numpy.array([1234.5, -0.125]), 'en_US')
+       [u'1,234.50', u'-0.12']
+
+    """
+    render = get_number_renderer(format_spec, locale)
+    return [render(value) for value in iter_values(values)]
@@ -7,17 +7,23 @@
    :license: BSD, see LICENSE for more details.
 
 """
+import decimal
+from functools import partial
 import math
 from numbers import Number
 
-from babel import Locale
 from babel.numbers import (
-    format_currency, get_decimal_symbol, get_territory_currencies,
-    NumberPattern, parse_pattern)
-from six import string_types, text_type as str
+    format_currency, get_currency_precision, get_currency_symbol,
+    get_decimal_symbol, get_territory_currencies)
+from six import integer_types, string_types, text_type as str
 from valuedispatch import valuedispatch
 
 from .local import LocalFormatter
+from .utils import (
+    cached, get_number_pattern, LRUCache, parse_locale, parse_pattern,
+    PreparedPattern)
+# Moved to :mod:`smartformat.utils`.  Kept for backward compatibility.
+from .utils import modify_number_pattern  # noqa: F401
 
 
 __all__ = ['DotNetFormatter']
@@ -26,17 +32,83 @@ __all__ = ['DotNetFormatter']
 NUMBER_DECIMAL_DIGITS = 2
 PERCENT_DECIMAL_DIGITS = 2
 SCIENTIFIC_DECIMAL_DIGITS = 6
+NUMBER_TYPES = integer_types + (float, decimal.Decimal)
 
 
-def modify_number_pattern(number_pattern, **kwargs):
-    """Modifies a number pattern by specified keyword arguments."""
-    params = ['pattern', 'prefix', 'suffix', 'grouping',
-              'int_prec', 'frac_prec', 'exp_prec', 'exp_plus']
-    for param in params:
-        if param in kwargs:
-            continue
-        kwargs[param] = getattr(number_pattern, param)
-    return NumberPattern(**kwargs)
+@cached(LRUCache(256))
+def get_default_currency(locale):
+    """Gets the currency which is currently used in the territory of a
+    locale.  The result is cached so it doesn't follow a currency change
+    until the process restarts.
+    """
+    locale = parse_locale(locale)
+    return get_territory_currencies(locale.territory)[0]
+
+
+@cached(LRUCache(1024))
+def prepare_currency_pattern(locale, currency, prec=None):
+    """Prepares the currency pattern of a locale for a currency.  The
+    currency symbol and the fractional digits are resolved only once.
+    Returns ``None`` if the pattern contains the currency name which depends
+    on the number.
+    """
+    pattern = get_number_pattern(locale, 'currency')
+    if any(u'¤¤¤' in affix for affix in pattern.prefix + pattern.suffix):
+        return None
+    symbol = get_currency_symbol(currency, locale)
+
+    def resolve(affixes):
+        return tuple(affix.replace(u'¤¤', currency.upper())
+                          .replace(u'¤', symbol) for affix in affixes)
+    pattern = get_number_pattern(locale, 'currency',
+                                 prefix=resolve(pattern.prefix),
+                                 suffix=resolve(pattern.suffix))
+    if prec is None:
+        digits = get_currency_precision(currency)
+    else:
+        digits = int(prec)
+    return PreparedPattern(pattern, locale, (digits, digits))
+
+
+@cached(LRUCache(1024))
+def get_custom_pattern(format_):
+    """Parses a custom numeric format such as ``#,##0.00``.  Returns ``None``
+    if the format is invalid.
+    """
+    try:
+        return parse_pattern(format_)
+    except ValueError:
+        return None
+
+
+@cached(LRUCache(256))
+def get_float_pattern(prec):
+    """Gets the number pattern for a fixed-point field."""
+    if prec is None:
+        return parse_pattern(u'0.' + u'#' * NUMBER_DECIMAL_DIGITS)
+    return parse_pattern(u'0.' + u'0' * int(prec))
+
+
+@cached(LRUCache(1024))
+def prepare_scientific_pattern(spec, prec, locale):
+    """Prepares a function which renders a number in scientific notation.
+    The pattern is made and parsed only once for a precision.
+    """
+    prec = SCIENTIFIC_DECIMAL_DIGITS if prec is None else int(prec)
+    pattern = parse_pattern(u'0.%sE+000' % (u'#' * prec))
+    decimal_symbol = get_decimal_symbol(locale)
+    # Babel before 2.5 doesn't localize the decimal symbol in scientific
+    # notation.  Check it once instead of replacing for each number.
+    localized = decimal_symbol == u'.' or \
+        decimal_symbol in pattern.apply(1.5, locale)
+    lower = spec.islower()
+
+    def render(number):
+        string = pattern.apply(number, locale)
+        if not localized:
+            string = string.replace(u'.', decimal_symbol)
+        return string.lower() if lower else string
+    return render
 
 
 @valuedispatch
@@ -44,27 +116,29 @@ def format_field(spec, arg, value, locale):
     if spec and isinstance(value, Number):
         if arg:
             spec += arg
-        try:
-            pattern = parse_pattern(spec)
-        except ValueError:
+        pattern = get_custom_pattern(spec)
+        if pattern is None:
             return spec
-        else:
-            return pattern.apply(value, locale)
+        return pattern.apply(value, locale)
     return str(value)
 
 
 @format_field.register(u'c')
 @format_field.register(u'C')
-def format_currency_field(__, prec, number, locale):
-    """Formats a currency field."""
-    locale = Locale.parse(locale)
-    currency = get_territory_currencies(locale.territory)[0]
+def format_currency_field(__, prec, number, locale, currency=None):
+    """Formats a currency field.  If the currency is not given, the default
+    currency of the locale is used.
+    """
+    locale = parse_locale(locale)
+    if currency is None:
+        currency = get_default_currency(locale)
     if prec is None:
-        pattern, currency_digits = None, True
+        pattern = get_number_pattern(locale, 'currency')
+        currency_digits = True
     else:
         prec = int(prec)
-        pattern = locale.currency_formats['standard']
-        pattern = modify_number_pattern(pattern, frac_prec=(prec, prec))
+        pattern = get_number_pattern(locale, 'currency',
+                                     frac_prec=(prec, prec))
         currency_digits = False
     return format_currency(number, currency, pattern, locale=locale,
                            currency_digits=currency_digits)
@@ -90,25 +164,15 @@ def format_decimal_field(__, prec, number, locale):
 @format_field.register(u'e')
 @format_field.register(u'E')
 def format_scientific_field(spec, prec, number, locale):
-    prec = SCIENTIFIC_DECIMAL_DIGITS if prec is None else int(prec)
-    format_ = u'0.%sE+000' % (u'#' * prec)
-    pattern = parse_pattern(format_)
-    decimal_symbol = get_decimal_symbol(locale)
-    string = pattern.apply(number, locale).replace(u'.', decimal_symbol)
-    return string.lower() if spec.islower() else string
+    render = prepare_scientific_pattern(spec, prec, parse_locale(locale))
+    return render(number)
 
 
 @format_field.register(u'f')
 @format_field.register(u'F')
 def format_float_field(__, prec, number, locale):
     """Formats a fixed-point field."""
-    format_ = u'0.'
-    if prec is None:
-        format_ += u'#' * NUMBER_DECIMAL_DIGITS
-    else:
-        format_ += u'0' * int(prec)
-    pattern = parse_pattern(format_)
-    return pattern.apply(number, locale)
+    return get_float_pattern(prec).apply(number, locale)
 
 
 @format_field.register(u'n')
@@ -116,8 +180,8 @@ def format_float_field(__, prec, number, locale):
 def format_number_field(__, prec, number, locale):
     """Formats a number field."""
     prec = NUMBER_DECIMAL_DIGITS if prec is None else int(prec)
-    locale = Locale.parse(locale)
-    pattern = locale.decimal_formats.get(None)
+    locale = parse_locale(locale)
+    pattern = get_number_pattern(locale, 'decimal')
     return pattern.apply(number, locale, force_frac=(prec, prec))
 
 
@@ -126,8 +190,8 @@ def format_number_field(__, prec, number, locale):
 def format_percent_field(__, prec, number, locale):
     """Formats a percent field."""
     prec = PERCENT_DECIMAL_DIGITS if prec is None else int(prec)
-    locale = Locale.parse(locale)
-    pattern = locale.percent_formats.get(None)
+    locale = parse_locale(locale)
+    pattern = get_number_pattern(locale, 'percent')
     return pattern.apply(number, locale, force_frac=(prec, prec))
 
 
@@ -151,11 +215,81 @@ def format_not_implemented_field(spec, *args, **kwargs):
                               'is not implemented yet' % spec)
 
 
+def render_by_pattern(prepared, spec, arg, locale, value):
+    if isinstance(value, NUMBER_TYPES) and not isinstance(value, bool):
+        return prepared(value)
+    return format_field(spec, arg, value, locale)
+
+
+def render_by_currency_pattern(prepared, spec, arg, locale, currency, value):
+    if isinstance(value, NUMBER_TYPES) and not isinstance(value, bool):
+        return prepared(value)
+    return format_currency_field(spec, arg, value, locale, currency)
+
+
+def render_by_custom_pattern(prepared, format_spec, value):
+    if not isinstance(value, Number):
+        return str(value)
+    elif prepared is None:
+        return format_spec
+    return prepared(value)
+
+
+@cached(LRUCache(1024))
+def get_field_renderer(format_spec, locale, currency=None):
+    """Parses a format spec into a function which renders a value same with
+    :func:`format_field`.  The locale symbols and the number pattern are
+    resolved only once.  The result is cached by the arguments.
+    """
+    if format_spec:
+        spec, arg = format_spec[0], format_spec[1:] or None
+    else:
+        spec = arg = None
+    if spec in (u'n', u'N', u'p', u'P'):
+        if spec in u'nN':
+            format_type, default_prec = 'decimal', NUMBER_DECIMAL_DIGITS
+        else:
+            format_type, default_prec = 'percent', PERCENT_DECIMAL_DIGITS
+        prec = default_prec if arg is None else int(arg)
+        pattern = get_number_pattern(locale, format_type)
+        prepared = PreparedPattern(pattern, locale, (prec, prec))
+    elif spec in (u'f', u'F'):
+        prepared = PreparedPattern(get_float_pattern(arg), locale)
+    elif spec in (u'e', u'E'):
+        return prepare_scientific_pattern(spec, arg, locale)
+    elif spec in (u'c', u'C'):
+        if currency is None:
+            currency = get_default_currency(locale)
+        prepared = prepare_currency_pattern(locale, currency, arg)
+        if prepared is None:
+            return partial(format_currency_field, spec, arg,
+                           locale=locale, currency=currency)
+        return partial(render_by_currency_pattern, prepared, spec, arg,
+                       locale, currency)
+    elif spec in (u'd', u'D'):
+        return partial(format_decimal_field, spec, arg, locale=locale)
+    elif spec and spec not in format_field.registry:
+        # A custom numeric format.
+        pattern = get_custom_pattern(format_spec)
+        prepared = pattern and PreparedPattern(pattern, locale)
+        return partial(render_by_custom_pattern, prepared, format_spec)
+    else:
+        return partial(format_field, spec, arg, locale=locale)
+    return partial(render_by_pattern, prepared, spec, arg, locale)
+
+
 class DotNetFormatter(LocalFormatter):
-    """A string formatter like `String.Format` in .NET Framework."""
+    """A string formatter like `String.Format` in .NET Framework.  If
+    `currency` is given, currency fields are formatted in the currency
+    instead of the default currency of the locale.
+    """
 
     _format_field = staticmethod(format_field)
 
+    def __init__(self, locale, currency=None):
+        super(DotNetFormatter, self).__init__(locale)
+        self.currency = currency
+
     def vformat(self, format_string, args, kwargs):
         if not format_string:
             return u''
@@ -172,11 +306,16 @@ class DotNetFormatter(LocalFormatter):
 
     def format_field(self, value, format_spec):
         """Format specifiers are described in :func:`format_field` which is a
-        static function.
+        static function.  Each format spec is parsed once by
+        :func:`get_field_renderer` unless a subclass overrides
+        `_format_field`.
         """
-        if format_spec:
-            spec, arg = format_spec[0], format_spec[1:]
-            arg = arg or None
-        else:
-            spec = arg = None
-        return self._format_field(spec, arg, value, self.numeric_locale)
+        if self._format_field is not format_field:
+            if format_spec:
+                spec, arg = format_spec[0], format_spec[1:] or None
+            else:
+                spec = arg = None
+            return self._format_field(spec, arg, value, self.numeric_locale)
+        render = get_field_renderer(format_spec, self.numeric_locale,
+                                    self.currency)
+        return render(value)
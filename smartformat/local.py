@@ -10,15 +10,23 @@
 import math
 import re
 import string
+import sys
 
-from babel import Locale
-from babel.numbers import get_group_symbol, LC_NUMERIC, NumberPattern
+from babel.numbers import get_group_symbol, LC_NUMERIC
+from six import get_unbound_function
+
+from .utils import (
+    cached, get_number_pattern, LRUCache, parse_locale, PreparedPattern)
+# Moved to :mod:`smartformat.utils`.  Kept for backward compatibility.
+from .utils import modify_number_pattern  # noqa: F401
 
 
 __all__ = ['LocalFormatter']
 
 
 DEFAULT_PREC = 6
+#: The grouping of a number pattern which never groups digits.
+NO_GROUPING = (sys.maxsize, sys.maxsize)
 FORMAT_SPEC_PATTERN = re.compile(r'''
     ^
     (?:
@@ -39,36 +47,46 @@ FORMAT_SPEC_PATTERN = re.compile(r'''
 ''', re.VERBOSE)
 
 
-def modify_number_pattern(number_pattern, **kwargs):
-    """Modifies a number pattern by specified keyword arguments."""
-    params = ['pattern', 'prefix', 'suffix', 'grouping',
-              'int_prec', 'frac_prec', 'exp_prec', 'exp_plus']
-    for param in params:
-        if param in kwargs:
-            continue
-        kwargs[param] = getattr(number_pattern, param)
-    return NumberPattern(**kwargs)
-
-
-def format_number(value, prec=0, prefix=None, locale=LC_NUMERIC):
-    locale = Locale.parse(locale)
-    pattern = locale.decimal_formats.get(None)
-    if prefix is not None:
-        pattern = modify_number_pattern(pattern, prefix=prefix)
-    return pattern.apply(value, locale, force_frac=(prec, prec))
-
-
-def format_percent(value, prec=0, prefix=None, locale=LC_NUMERIC):
-    locale = Locale.parse(locale)
-    pattern = locale.percent_formats.get(None)
-    prefix = prefix or pattern.prefix
-    pos_suffix, neg_suffix = pattern.suffix
-    suffix = (pos_suffix.lstrip(), neg_suffix.lstrip())
-    pattern = modify_number_pattern(pattern, prefix=prefix, suffix=suffix)
-    return pattern.apply(value, locale, force_frac=(prec, prec))
+@cached(LRUCache(1024))
+def prepare_number_pattern(locale, prec=0, prefix=None, grouping=True,
+                           percent=False):
+    """Prepares the number pattern of a locale to format numbers with the
+    fractional precision, the sign prefix and grouping or not.  Returns a
+    :class:`~smartformat.utils.PreparedPattern`.
+    """
+    locale = parse_locale(locale)
+    format_type = 'percent' if percent else 'decimal'
+    kwargs = {}
+    if percent:
+        pattern = get_number_pattern(locale, format_type)
+        kwargs['prefix'] = prefix or pattern.prefix
+        pos_suffix, neg_suffix = pattern.suffix
+        kwargs['suffix'] = (pos_suffix.lstrip(), neg_suffix.lstrip())
+    elif prefix is not None:
+        kwargs['prefix'] = prefix
+    if not grouping:
+        kwargs['grouping'] = NO_GROUPING
+    pattern = get_number_pattern(locale, format_type, **kwargs)
+    return PreparedPattern(pattern, locale, (prec, prec))
+
+
+def format_number(value, prec=0, prefix=None, locale=LC_NUMERIC,
+                  grouping=True):
+    pattern = prepare_number_pattern(locale, prec, prefix, grouping)
+    return pattern(value)
+
+
+def format_percent(value, prec=0, prefix=None, locale=LC_NUMERIC,
+                   grouping=True):
+    pattern = prepare_number_pattern(locale, prec, prefix, grouping, True)
+    return pattern(value)
 
 
 def remove_group_symbols(string, locale=LC_NUMERIC):
+    """Removes the group symbols of a locale from a formatted number.  The
+    formatters don't need it anymore because the number patterns are
+    prepared without grouping.  Kept for backward compatibility.
+    """
     symbol = get_group_symbol(locale)
     return string.replace(symbol, '')
 
@@ -80,57 +98,93 @@ def get_prefix(sign):
         return (sign, u'-')
 
 
+@cached(LRUCache(1024))
+def get_field_renderer(format_spec, locale):
+    """Parses a format spec into a function which renders a number in the
+    locale.  The function returns ``None`` for a value which it doesn't
+    handle such as NaN.  Returns ``None`` if the format spec is not for a
+    locale-specific number.  The result is cached by the arguments.
+    """
+    match = FORMAT_SPEC_PATTERN.match(format_spec)
+    if match is None:
+        return None
+    groups = match.groups()
+    fill, align, sign, sharp, zero, width, comma, prec, type_ = groups
+    if not comma and not prec and type_ not in list('fF%'):
+        return None
+    # Prepare the number pattern.
+    prefix = get_prefix(sign)
+    grouping = bool(comma)
+    if type_ == 'd':
+        if prec is not None:
+            pattern = None
+        else:
+            pattern = prepare_number_pattern(locale, 0, prefix, grouping)
+    elif type_ in 'fF%':
+        pattern = prepare_number_pattern(locale, int(prec or DEFAULT_PREC),
+                                         prefix, grouping, type_ == '%')
+    else:
+        # Don't handle otherwise.
+        return None
+    # Prepare a layout.
+    if fill or align or zero or width:
+        layout = u''.join([fill or u'', align or u'>',
+                           zero or u'', width or u''])
+    else:
+        layout = None
+
+    def render(value):
+        if math.isnan(value) or math.isinf(value):
+            return None
+        if pattern is None:
+            raise ValueError('precision not allowed in '
+                             'integer format specifier')
+        string = pattern(value)
+        if layout is None:
+            return string
+        return format(string, layout)
+    return render
+
+
 class LocalFormatter(string.Formatter):
     """A formatter which keeps a locale."""
 
     def __init__(self, locale):
-        self.locale = Locale.parse(locale)
+        self.locale = parse_locale(locale)
 
     @property
     def numeric_locale(self):
         return self.locale or LC_NUMERIC
 
     def format_field(self, value, format_spec):
-        match = FORMAT_SPEC_PATTERN.match(format_spec)
-        if match is not None:
-            rv = self.format_field_by_match(value, match)
-            if rv is not None:
-                return rv
+        format_field_by_match = \
+            get_unbound_function(type(self).format_field_by_match)
+        if format_field_by_match is _format_field_by_match:
+            render = get_field_renderer(format_spec, self.numeric_locale)
+            rv = None if render is None else render(value)
+        else:
+            # A subclass overrides :meth:`format_field_by_match`.
+            match = FORMAT_SPEC_PATTERN.match(format_spec)
+            if match is None:
+                rv = None
+            else:
+                rv = self.format_field_by_match(value, match)
+        if rv is not None:
+            return rv
         base = super(LocalFormatter, self)
         return base.format_field(value, format_spec)
 
     def format_field_by_match(self, value, match):
-        """Formats a field by a Regex match of the format spec pattern."""
-        groups = match.groups()
-        fill, align, sign, sharp, zero, width, comma, prec, type_ = groups
-        if not comma and not prec and type_ not in list('fF%'):
-            return None
-        if math.isnan(value) or math.isinf(value):
-            return None
-        locale = self.numeric_locale
-        # Format number value.
-        prefix = get_prefix(sign)
-        if type_ == 'd':
-            if prec is not None:
-                raise ValueError('precision not allowed in '
-                                 'integer format specifier')
-            string = format_number(value, 0, prefix, locale)
-        elif type_ in 'fF%':
-            format_ = format_percent if type_ == '%' else format_number
-            string = format_(value, int(prec or DEFAULT_PREC), prefix, locale)
-        else:
-            # Don't handle otherwise.
-            return None
-        if not comma:
-            # Formatted number always contains group symbols.
-            # Remove the symbols if not required.
-            string = remove_group_symbols(string, locale)
-        if not (fill or align or zero or width):
-            return string
-        # Fix a layout.
-        spec = ''.join([fill or u'', align or u'>',
-                        zero or u'', width or u''])
-        return format(string, spec)
+        """Formats a field by a Regex match of the format spec pattern.  The
+        format spec is parsed once by :func:`get_field_renderer`.
+        """
+        render = get_field_renderer(match.string, self.numeric_locale)
+        if render is not None:
+            return render(value)
+
+
+_format_field_by_match = \
+    get_unbound_function(LocalFormatter.format_field_by_match)
 
 
 # f = LocalFormatter('hi_IN')
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+   smartformat.parallel
+   ~~~~~~~~~~~~~~~~~~~~
+
+   Formats many rows in a process pool.  The configuration and the compiled
+   templates of a formatter are shipped to each worker process once.
+
+   :copyright: (c) 2016 by What! Studio
+   :license: BSD, see LICENSE for more details.
+
+"""
+from collections import deque
+from importlib import import_module
+from itertools import islice
+import multiprocessing
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+
+__all__ = ['DEFAULT_CHUNK_SIZE', 'get_class_path', 'get_config',
+           'get_extension_path', 'import_class', 'import_extension',
+           'iformat_parallel']
+
+
+#: The default number of rows which a worker formats at once.
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def _get_path(obj, named):
+    # Gets the importable name of `obj` by the module and the name of
+    # `named`.
+    module_name = getattr(named, '__module__', None)
+    name = getattr(named, '__name__', None)
+    if module_name is None or name is None:
+        return None
+    try:
+        module = import_module(module_name)
+    except ImportError:
+        return None
+    if getattr(module, name, None) is not obj:
+        return None
+    return '%s:%s' % (module_name, name)
+
+
+def _import(path):
+    module_name, __, name = path.partition(':')
+    return getattr(import_module(module_name), name)
+
+
+def get_extension_path(ext):
+    """Gets the importable name of an extension such as
+    ``smartformat.builtin:plural``.  Returns ``None`` if the extension cannot
+    be imported by the name.
+    """
+    return _get_path(ext, ext.function)
+
+
+def import_extension(path):
+    """Imports an extension by the name made by :func:`get_extension_path`."""
+    return _import(path)
+
+
+def get_class_path(cls):
+    """Gets the importable name of a formatter class such as
+    ``smartformat.smart:SmartFormatter``.  Returns ``None`` if the class cannot
+    be imported by the name.
+    """
+    return _get_path(cls, cls)
+
+
+def import_class(path):
+    """Imports a formatter class by the name made by :func:`get_class_path`.
+    """
+    return _import(path)
+
+
+def get_config(formatter):
+    """Gets the configuration to make the same formatter in another process.
+    Returns ``None`` if the formatter class or some extension cannot be
+    imported by name.
+    """
+    class_path = get_class_path(type(formatter))
+    if class_path is None:
+        return None
+    registry = {}
+    for name, exts in formatter._extensions.items():
+        paths = []
+        for ext in exts:
+            path = get_extension_path(ext)
+            if path is None:
+                return None
+            paths.append(path)
+        registry[name] = paths
+    locale = None if formatter.locale is None else str(formatter.locale)
+    return {'class': class_path, 'locale': locale, 'errors': formatter.errors,
+            'currency': formatter.currency, 'extensions': registry}
+
+
+#: The formatter in a worker process.
+_worker_formatter = None
+
+
+def _init_worker(config, templates):
+    global _worker_formatter
+    formatter_class = import_class(config['class'])
+    formatter = formatter_class(config['locale'], register_default=False,
+                                errors=config['errors'],
+                                currency=config['currency'])
+    formatter._extensions = dict(
+        (name, tuple(import_extension(path) for path in paths))
+        for name, paths in config['extensions'].items())
+    formatter._load(templates)
+    _worker_formatter = formatter
+
+
+def _format_chunk(format_string, rows):
+    return list(_worker_formatter.iformat_many(format_string, rows))
+
+
+def iter_chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def iformat_parallel(formatter, format_string, rows, max_workers=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE):
+    """Same with :meth:`SmartFormatter.iformat_many` but formats the rows in
+    chunks in a process pool.  The results are yielded in order of the rows.
+    Rows should be picklable.
+
+    The workers make the formatters of the same class with the same
+    arguments as :class:`SmartFormatter`.  It falls back to
+    :meth:`SmartFormatter.iformat_many` if `max_workers` is 1, the formatter
+    class or some extension cannot be imported by name, or the platform has
+    no process pool.
+    """
+    config = get_config(formatter)
+    if config is None or ProcessPoolExecutor is None or max_workers == 1:
+        return formatter.iformat_many(format_string, rows)
+    # Compile the template to ship it with the nested templates.
+    formatter.compile(format_string)
+    templates = formatter._dump()
+    try:
+        executor = ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                       initargs=(config, templates))
+    except TypeError:
+        # No initializer before Python 3.7.
+        return formatter.iformat_many(format_string, rows)
+    num_workers = max_workers or multiprocessing.cpu_count()
+    return _iter_results(executor, num_workers * 2, format_string,
+                         iter_chunks(rows, chunk_size))
+
+
+def _iter_results(executor, window, format_string, chunks):
+    # Submits chunks keeping `window` chunks in flight and yields the results
+    # in order.
+    with executor:
+        pending = deque()
+        for chunk in chunks:
+            future = executor.submit(_format_chunk, format_string, chunk)
+            pending.append(future)
+            if len(pending) < window:
+                continue
+            for result in pending.popleft().result():
+                yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
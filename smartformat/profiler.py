@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+   smartformat.profiler
+   ~~~~~~~~~~~~~~~~~~~~
+
+   Opt-in instrumentation for formatters.  Set a profiler to a
+   :class:`~smartformat.smart.SmartFormatter` to find where the time goes::
+
+      >>> profiler = Profiler()
+      >>> smart = SmartFormatter('en_US', profiler=profiler)
+      >>> smart.format(u'{0:an item|{} items}', 42)
+      u'42 items'
+      >>> profiler.stats()
+      [ProfileStat(kind='render', key=u'{0:an item|{} items}', ...), ...]
+
+   :copyright: (c) 2016 by What! Studio
+   :license: BSD, see LICENSE for more details.
+
+"""
+from collections import namedtuple
+import threading
+from timeit import default_timer
+
+
+__all__ = ['default_timer', 'ProfileStat', 'Profiler', 'profile_extension']
+
+
+#: A statistic of a profiled operation.  `kind` is one of ``'parse'``,
+#: ``'render'``, ``'extension'``, ``'eval_extensions'`` and
+#: ``'format_field'``.  `key` is the format string for ``'parse'`` and
+#: ``'render'``, the extension name for ``'extension'`` and
+#: ``'eval_extensions'``, or the format spec for ``'format_field'``.
+ProfileStat = namedtuple('ProfileStat', ['kind', 'key', 'count', 'total'])
+
+
+class Profiler(object):
+    """Collects the counts and the cumulative durations of the operations in
+    formatters.  Any object which has the same `record` method can be used
+    as a profiler.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, key, elapsed):
+        """Records an operation which took `elapsed` seconds."""
+        with self._lock:
+            try:
+                stat = self._stats[kind, key]
+            except KeyError:
+                stat = self._stats[kind, key] = [0, 0.]
+            stat[0] += 1
+            stat[1] += elapsed
+
+    def stats(self, kind=None):
+        """Returns a list of :data:`ProfileStat` in descending order of the
+        cumulative durations.  If `kind` is given, returns only the
+        statistics of the kind.
+        """
+        with self._lock:
+            items = list(self._stats.items())
+        stats = [ProfileStat(k, key, count, total)
+                 for (k, key), (count, total) in items
+                 if kind is None or k == kind]
+        stats.sort(key=lambda stat: stat.total, reverse=True)
+        return stats
+
+    def clear(self):
+        """Discards all statistics."""
+        with self._lock:
+            self._stats.clear()
+
+
+def profile_extension(prepared, profiler, name):
+    """Wraps a prepared extension to record its calls.  A streamed result is
+    not timed because it is consumed after the call.
+    """
+    record = profiler.record
+
+    def profiled(formatter, value):
+        started = default_timer()
+        try:
+            return prepared(formatter, value)
+        finally:
+            record('extension', name, default_timer() - started)
+    stream = getattr(prepared, 'stream', None)
+    if stream is not None:
+        profiled.stream = stream
+    return profiled
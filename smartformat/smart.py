@@ -8,15 +8,28 @@
 
 """
 from collections import deque
+from decimal import Decimal
 import io
+import marshal
 import re
-import string
 import sys
+import threading
 from types import MethodType
 
-from six import reraise, text_type
+from six import (
+    binary_type, get_unbound_function, integer_types, reraise, string_types,
+    text_type)
 
+from .__about__ import __version__
 from .dotnet import DotNetFormatter
+from .profiler import default_timer, profile_extension
+from .template import Field, Spec, Template
+from .utils import LRUCache, parse_locale
+
+try:
+    from enum import Enum
+except ImportError:
+    Enum = None
 
 
 __all__ = ['default_extensions', 'extension', 'SmartFormatter']
@@ -26,6 +39,15 @@ __all__ = ['default_extensions', 'extension', 'SmartFormatter']
 default_extensions = deque()
 
 
+#: The default maximum number of compiled templates to keep in a formatter.
+DEFAULT_CACHE_SIZE = 1024
+
+
+#: The marker of compiled template files made by
+#: :meth:`SmartFormatter.dump_templates`.
+TEMPLATES_FILE_MAGIC = 'smartformat-templates'
+
+
 NAME_PATTERN = re.compile(r'[a-zA-Z_]*')
 FORMAT_SPEC_PATTERN = re.compile(r'''
     (?:
@@ -39,58 +61,590 @@ FORMAT_SPEC_PATTERN = re.compile(r'''
 ''', re.VERBOSE | re.UNICODE)
 
 
-# :meth:`string.Formatter._vformat` on Python 3.5.1 returns a pair
-# `(format_spec, auto_arg_index)`.  The method is not public but we should
-# override it to keep nested format specs.
-f = string.Formatter()
-VFORMAT_RETURNS_TUPLE = isinstance(f._vformat('', (), {}, [], 0), tuple)
-del f
-
-
 def parse_format_spec(format_spec):
     m = FORMAT_SPEC_PATTERN.match(format_spec)
     return m.group('name') or u'', m.group('option'), m.group('format')
 
 
+#: The types of immutable values which can be a part of the key of a memoized
+#: result.
+IMMUTABLE_TYPES = frozenset(
+    (text_type, binary_type, bool, type(None)) + tuple(integer_types))
+
+
+def make_memo_key(value):
+    """Makes the key of an immutable value for the memoized results.  Equal
+    values which may be formatted differently such as ``1``, ``1.0`` and
+    ``-0.0`` get different keys.  Raises :exc:`TypeError` if the value is not
+    an immutable value or a tuple or frozenset of them.
+    """
+    cls = type(value)
+    if cls in IMMUTABLE_TYPES:
+        return (cls, value)
+    elif cls is float or cls is Decimal:
+        return (cls, repr(value))
+    elif cls is tuple or cls is frozenset:
+        return (cls, cls(make_memo_key(x) for x in value))
+    elif Enum is not None and isinstance(value, Enum):
+        return (cls, value)
+    raise TypeError('%s is not immutable' % cls.__name__)
+
+
 class SmartFormatter(DotNetFormatter):
 
     def __init__(self, locale=None, extensions=(), register_default=True,
-                 errors='strict'):
-        super(SmartFormatter, self).__init__(locale)
+                 errors='strict', cache_size=DEFAULT_CACHE_SIZE,
+                 currency=None, profiler=None, result_cache_size=0):
+        super(SmartFormatter, self).__init__(locale, currency)
         # Set error action.
         try:
             _format_error = self._error_formatters[errors]
         except KeyError:
             raise LookupError('unknown error action name %s' % errors)
         self.format_error = MethodType(_format_error, self)
-        if errors == 'skip':
-            self.parse = self._parse_for_skip_error_action
         self.errors = errors
-        # Currently implemented only formatter extensions.
+        # An optional profiler.  See :mod:`smartformat.profiler`.
+        self.profiler = profiler
+        # Compiled templates by format strings.
+        self._templates = LRUCache(cache_size)
+        # Memoized results of pure templates.  Disabled by default.
+        if result_cache_size == 0:
+            self._results = None
+        else:
+            self._results = LRUCache(result_cache_size)
+        # Whether to memoize the results by format strings.  It overrides the
+        # purity of the templates.  See :meth:`set_memoize`.
+        self._memoize = {}
+        # The templates compiled while compiling a template.
+        self._nested = threading.local()
+        # The formatting hooks overridden by a subclass.  Compiled templates
+        # skip the stock hooks but call the overridden ones.
+        self._custom_format_field = self._overrides('format_field')
+        self._custom_eval_extensions = self._overrides('eval_extensions')
+        self._custom_check_unused_args = self._overrides('check_unused_args')
+        # Currently implemented only formatter extensions.  The registry is
+        # never modified but replaced so that it can be shared.
         self._extensions = {}
         if register_default:
             self.register(default_extensions)
         self.register(extensions)
 
     def register(self, extensions):
-        """Registers extensions."""
+        """Registers extensions.  Formatters made by :meth:`with_locale`
+        before are not affected.
+        """
+        registry = dict(self._extensions)
         for ext in reversed(extensions):
             for name in ext.names:
-                try:
-                    self._extensions[name].appendleft(ext)
-                except KeyError:
-                    self._extensions[name] = deque([ext])
+                registry[name] = (ext,) + registry.get(name, ())
+        self._extensions = registry
+        # Compiled templates have been prepared by the old extensions.
+        self._templates = LRUCache(self._templates.maxsize)
+        if self._results is not None:
+            self._results = LRUCache(self._results.maxsize)
+
+    def set_profiler(self, profiler):
+        """Sets a profiler or ``None`` to stop profiling.  Formatters made by
+        :meth:`with_locale` before are not affected.
+        """
+        self.profiler = profiler
+        # Compiled templates have been prepared with the old profiler.
+        self._templates = LRUCache(self._templates.maxsize)
 
-    def format_field(self, value, format_spec):
+    def with_locale(self, locale):
+        """Makes a formatter for another locale.  It is cheap because the
+        extensions and the compiled template cache are shared with this
+        formatter::
+
+           >>> smart = SmartFormatter('en_US')
+           >>> smart.with_locale('ko_KR').format(u'{0:n0}', 1234)
+           u'1,234'
+
+        """
+        formatter = object.__new__(type(self))
+        formatter.__dict__.update(self.__dict__)
+        formatter.locale = parse_locale(locale)
+        formatter.format_error = \
+            MethodType(self._error_formatters[self.errors], formatter)
+        return formatter
+
+    def compile(self, format_string):
+        """Parses a format string into a :class:`smartformat.template.Template`
+        which can be rendered many times without parsing::
+
+           >>> template = smart.compile(u'{0:an item|{} items}')
+           >>> template.render(42)
+           u'42 items'
+
+        Compiled templates are cached by the format strings.  The cache is
+        shared with the formatters made by :meth:`with_locale`.
+        """
+        template = self._templates.get(format_string)
+        if template is None:
+            profiler = self.profiler
+            if profiler is None:
+                template = self._compile(format_string)
+            else:
+                started = default_timer()
+                template = self._compile(format_string)
+                profiler.record('parse', format_string,
+                                default_timer() - started)
+            self._templates.set(format_string, template)
+        elif template.formatter is not self:
+            template = template.bind(self)
+        nested = getattr(self._nested, 'templates', None)
+        if nested is not None:
+            nested.append(template)
+        return template
+
+    def _compile(self, format_string):
+        return self._build(format_string, self._parse(format_string))
+
+    def _parse(self, format_string):
+        # Parses a format string into a list of `(literal_text, field_name,
+        # conversion, format_spec)`.  It can be serialized by marshal.
+        parsed = []
+        literal_texts = []
+        for literal_text, field_name, format_spec, conversion in \
+                self.parse(format_string):
+            literal_texts.append(literal_text)
+            if field_name is None:
+                # Escaped braces split a literal text.  Join them.
+                continue
+            parsed.append((u''.join(literal_texts), field_name,
+                           conversion, format_spec))
+            del literal_texts[:]
+        if literal_texts:
+            parsed.append((u''.join(literal_texts), None, None, None))
+        return parsed
+
+    def _build(self, format_string, parsed):
+        # Makes a template from the result of :meth:`_parse`.
+        chunks = []
+        # Overridden hooks may not be pure.
+        pure = not self._custom_format_field and \
+            not self._custom_eval_extensions
+        direct = not self._overrides('get_value') and \
+            not self._overrides('get_field')
+        # Collect nested templates compiled by the extensions.
+        outer_nested = getattr(self._nested, 'templates', None)
+        self._nested.templates = nested = []
+        try:
+            for literal_text, field_name, conversion, format_spec in parsed:
+                if field_name is None:
+                    chunks.append((literal_text, None))
+                    continue
+                spec = self.compile_format_spec(format_spec)
+                field = Field(field_name, conversion, spec, direct)
+                if direct and isinstance(field.first, string_types) and \
+                   u',' in field.first:
+                    # Same with :meth:`DotNetFormatter.get_value`.
+                    raise NotImplementedError('width specifier after comma '
+                                              'is not implemented yet')
+                chunks.append((literal_text, field))
+                exts = self._extensions.get(spec.name, ())
+                pure = pure and all(ext.pure for ext in exts)
+        finally:
+            self._nested.templates = outer_nested
+        pure = pure and all(t.pure for t in nested)
+        return Template(self, format_string, chunks, pure)
+
+    def _overrides(self, name):
+        # Whether a subclass overrides a method of :class:`SmartFormatter`.
+        # Fields are looked up directly and formatted by the prepared
+        # extensions only if the hooks are not overridden.
+        method = getattr(type(self), name)
+        stock = getattr(SmartFormatter, name)
+        return get_unbound_function(method) is not get_unbound_function(stock)
+
+    def _unbuild(self, template):
+        # Reverses :meth:`_build`.
+        parsed = []
+        for literal_text, field in template.chunks:
+            if field is None:
+                parsed.append((literal_text, None, None, None))
+            else:
+                parsed.append((literal_text, field.field_name,
+                               field.conversion, field.spec.format_spec))
+        return parsed
+
+    def _templates_file_key(self):
+        # Compiled template files are valid only for the same smartformat,
+        # the same marshal format and the same extensions.
+        extensions = []
+        for name, exts in sorted(self._extensions.items()):
+            ext_names = tuple('%s.%s' % (ext.function.__module__,
+                                         ext.function.__name__)
+                              for ext in exts)
+            extensions.append((name, ext_names))
+        return (TEMPLATES_FILE_MAGIC, __version__,
+                tuple(sys.version_info[:2]), tuple(extensions))
+
+    def dump_templates(self, path):
+        """Saves the compiled templates in the cache into a file.  Build the
+        file at the deploy time and load it by :meth:`load_templates` to skip
+        parsing the format strings in each process::
+
+           >>> for format_string in catalog:
+           ...     smart.compile(format_string)
+           >>> smart.dump_templates('templates.bin')
+
+        """
+        data = (self._templates_file_key(), self._dump())
+        with open(path, 'wb') as f:
+            marshal.dump(data, f)
+
+    def load_templates(self, path):
+        """Loads compiled templates from a file made by
+        :meth:`dump_templates` into the cache.  The extensions are prepared
+        again.  Returns the number of the loaded templates.
+
+        :raises ValueError: the file was made by another version of
+                            smartformat or Python, or with other extensions.
+
+        """
+        with open(path, 'rb') as f:
+            try:
+                key, templates = marshal.load(f)
+            except (EOFError, TypeError, ValueError):
+                raise ValueError('not a compiled template file: %s' % path)
+        if key != self._templates_file_key():
+            raise ValueError('stale compiled template file: %s' % path)
+        return self._load(templates)
+
+    def _dump(self):
+        # Gets the compiled templates in the cache as a marshal-able list.
+        return [(format_string, self._unbuild(template))
+                for format_string, template in self._templates.items()]
+
+    def _load(self, templates):
+        # Loads the result of :meth:`_dump` into the cache.  Nested templates
+        # come first because they are compiled before the templates which
+        # contain them.
+        count = 0
+        for format_string, parsed in templates:
+            if format_string in self._templates:
+                continue
+            template = self._build(format_string, parsed)
+            self._templates.set(format_string, template)
+            count += 1
+        return count
+
+    def cache_info(self):
+        """Reports the statistics of the compiled template cache as a
+        :data:`~smartformat.utils.CacheInfo`.
+        """
+        return self._templates.info()
+
+    def cache_clear(self):
+        """Discards all compiled templates and memoized results in the
+        cache.
+        """
+        self._templates.clear()
+        if self._results is not None:
+            self._results.clear()
+
+    def set_memoize(self, format_string, memoize):
+        """Enables or disables the memoization of the results of a format
+        string regardless of whether the template is pure.  Set ``None`` to
+        follow the purity again.  It is shared with the formatters made by
+        :meth:`with_locale`.
+        """
+        if memoize is None:
+            self._memoize.pop(format_string, None)
+        else:
+            self._memoize[format_string] = bool(memoize)
+
+    def result_cache_info(self):
+        """Reports the statistics of the memoized results as a
+        :data:`~smartformat.utils.CacheInfo` or ``None`` if the memoization
+        is disabled.
+        """
+        if self._results is not None:
+            return self._results.info()
+
+    def compile_format_spec(self, format_spec):
+        """Parses a format spec into a :class:`~smartformat.template.Spec`
+        with the prepared extensions for the spec.
+        """
         name, option, format = parse_format_spec(format_spec)
+        if self._custom_eval_extensions:
+            # Evaluate the extensions by the overridden hook.
+
+            def prepared(formatter, value):
+                return formatter.eval_extensions(value, name, option, format)
+            return Spec(format_spec, name, option, format, [prepared])
+        try:
+            exts = self._extensions[name]
+        except KeyError:
+            return Spec(format_spec, name, option, format, None)
+        prepared_exts, types = [], []
+        for ext in exts:
+            prepared = self.prepare_extension(ext, name, option, format)
+            if prepared is not None:
+                prepared_exts.append(prepared)
+                types.append(ext.types)
+        return Spec(format_spec, name, option, format,
+                    prepared_exts, tuple(types))
+
+    def prepare_extension(self, ext, name, option, format):
+        """Prepares an extension for a format spec.  An error while preparing
+        is deferred until the prepared extension is called so that the error
+        action handles it.
+        """
+        try:
+            prepared = ext.prepare(self, name, option, format)
+        except Exception:
+            exc_info = sys.exc_info()
+
+            def prepared(formatter, value):
+                reraise(*exc_info)
+        if prepared is not None and self.profiler is not None:
+            prepared = profile_extension(prepared, self.profiler,
+                                         ext.names[0] if ext.names else name)
+        return prepared
+
+    def vformat(self, format_string, args, kwargs):
+        if u'{' not in format_string and u'}' not in format_string:
+            # Nothing to format.
+            return format_string
+        template = self.compile(format_string)
+        rv = self.vrender(template, args, kwargs)
+        if self._custom_check_unused_args:
+            used_args = set(field.first for __, field in template.chunks
+                            if field is not None)
+            self.check_unused_args(used_args, args, kwargs)
+        return rv
+
+    def format_many(self, format_string, rows):
+        """Formats a format string with many argument sets at once.  Each row
+        is a mapping of keyword arguments or a sequence of positional
+        arguments.  Returns a list of the results.
+        """
+        return list(self.iformat_many(format_string, rows))
+
+    def iformat_many(self, format_string, rows):
+        """Same with :meth:`format_many` but yields the results lazily."""
+        template = self.compile(format_string)
+        vrender = self.vrender
+        for row in rows:
+            if hasattr(row, 'keys'):
+                yield vrender(template, (), row)
+            else:
+                yield vrender(template, row, {})
+
+    def format_parallel(self, format_string, rows, max_workers=None,
+                        chunk_size=None):
+        """Same with :meth:`format_many` but formats the rows in a process
+        pool.  See :func:`smartformat.parallel.iformat_parallel`.
+        """
+        return list(self.iformat_parallel(format_string, rows,
+                                          max_workers, chunk_size))
+
+    def iformat_parallel(self, format_string, rows, max_workers=None,
+                         chunk_size=None):
+        """Same with :meth:`format_parallel` but yields the results in
+        chunks.
+        """
+        from .parallel import DEFAULT_CHUNK_SIZE, iformat_parallel
+        return iformat_parallel(self, format_string, rows, max_workers,
+                                chunk_size or DEFAULT_CHUNK_SIZE)
+
+    def vrender(self, template, args, kwargs):
+        """Renders a compiled template.  Unlike :meth:`vformat`, it doesn't
+        parse anything.  The fields are looked up by the field names split at
+        the compile time unless :meth:`get_field` or :meth:`get_value` is
+        overridden.  Likewise, the fields are formatted by the prepared
+        extensions unless :meth:`format_field` or :meth:`eval_extensions` is
+        overridden.
+        """
+        if template.literal is not None:
+            return template.literal
+        results = self._results
+        if results is None:
+            return self._vrender(template, args, kwargs)
+        memoize = self._memoize.get(template.format_string, template.pure)
+        if not memoize:
+            return self._vrender(template, args, kwargs)
         try:
-            rv = self.eval_extensions(value, name, option, format)
+            key = (template.format_string, self.locale,
+                   make_memo_key(tuple(args)),
+                   make_memo_key(tuple(sorted(kwargs.items()))))
+        except TypeError:
+            # A mutable argument may change until the next rendering.
+            return self._vrender(template, args, kwargs)
+        rv = results.get(key)
+        if rv is None:
+            rv = self._vrender(template, args, kwargs)
+            results.set(key, rv)
+        return rv
+
+    def _vrender(self, template, args, kwargs):
+        profiler = self.profiler
+        if profiler is not None:
+            started = default_timer()
+        convert_field = self.convert_field
+        if self._custom_format_field:
+            format_field_by_spec = self._format_field_by_hook
+        else:
+            format_field_by_spec = self.format_field_by_spec
+        buf = []
+        for literal_text, field in template.chunks:
+            if literal_text:
+                buf.append(literal_text)
+            if field is None:
+                continue
+            if field.direct:
+                value = field.get_value(args, kwargs)
+            else:
+                value, __ = self.get_field(field.field_name, args, kwargs)
+            value = convert_field(value, field.conversion)
+            buf.append(format_field_by_spec(value, field.spec, field))
+        rv = u''.join(buf)
+        if profiler is not None:
+            profiler.record('render', template.format_string,
+                            default_timer() - started)
+        return rv
+
+    def iter_render(self, template, *args, **kwargs):
+        """Renders a template or a format string and yields the chunks of the
+        result without building the whole string.
+        """
+        if not isinstance(template, Template):
+            template = self.compile(template)
+        return self.ivrender(template, args, kwargs)
+
+    def render_to(self, writer, template, *args, **kwargs):
+        """Renders a template or a format string into a text stream such as a
+        file or a socket wrapper.  `writer` should have a `write` method.
+        """
+        write = writer.write
+        for chunk in self.iter_render(template, *args, **kwargs):
+            write(chunk)
+
+    def ivrender(self, template, args, kwargs):
+        """Same with :meth:`vrender` but yields the chunks of the result."""
+        if template.literal is not None:
+            if template.literal:
+                yield template.literal
+            return
+        for literal_text, field in template.chunks:
+            if literal_text:
+                yield literal_text
+            if field is None:
+                continue
+            if field.direct:
+                value = field.get_value(args, kwargs)
+            else:
+                value, __ = self.get_field(field.field_name, args, kwargs)
+            value = self.convert_field(value, field.conversion)
+            if self._custom_format_field:
+                yield self._format_field_by_hook(value, field.spec, field)
+                continue
+            for chunk in self.iter_field_by_spec(value, field.spec, field):
+                yield chunk
+
+    def iter_field_by_spec(self, value, spec, field=None):
+        """Same with :meth:`format_field_by_spec` but yields chunks.  A
+        prepared extension which has a `stream` function streams its result.
+        The `stream` function takes `(formatter, value)` and returns an
+        iterable of chunks or ``None``.
+
+        Unless the error action is ``'strict'``, a streamed field is buffered
+        so that an error in the middle of the stream leaves only the result
+        of the error action, same with :meth:`format_field_by_spec`.
+        """
+        try:
+            prepared_exts = spec.dispatch(value)
+            if prepared_exts is None:
+                raise ValueError('no suitable extension: %s' % spec.name)
+            rv = chunks = None
+            profiler = self.profiler
+            if profiler is not None:
+                started = default_timer()
+            try:
+                for prepared in prepared_exts:
+                    stream = getattr(prepared, 'stream', None)
+                    if stream is None:
+                        rv = prepared(self, value)
+                        if rv is not None:
+                            break
+                        continue
+                    chunks = stream(self, value)
+                    if chunks is not None:
+                        break
+            finally:
+                # A streamed result is consumed out of the span.
+                if profiler is not None:
+                    profiler.record('eval_extensions', spec.name,
+                                    default_timer() - started)
             if rv is not None:
-                return rv
-            base = super(SmartFormatter, self)
-            return base.format_field(value, format_spec)
+                yield rv
+                return
+            if chunks is not None:
+                if self.errors != 'strict':
+                    chunks = list(chunks)
+                for chunk in chunks:
+                    yield chunk
+                return
+            yield self._format_field_by_base(value, spec.format_spec)
+        except GeneratorExit:
+            raise
+        except Exception:
+            yield self.format_error(sys.exc_info(),
+                                    field or self._anonymous_field(spec))
+
+    def format_field(self, value, format_spec):
+        spec = self.compile_format_spec(format_spec)
+        return self.format_field_by_spec(value, spec)
+
+    def format_field_by_spec(self, value, spec, field=None):
+        """Formats a field by a compiled format spec.  `field` is the
+        replacement field which has the spec.  It is passed to the error action
+        instead of being kept in the formatter so that a formatter can format
+        nested or concurrent fields safely.
+        """
+        try:
+            prepared_exts = spec.dispatch(value)
+            if prepared_exts is None:
+                raise ValueError('no suitable extension: %s' % spec.name)
+            profiler = self.profiler
+            if profiler is not None:
+                started = default_timer()
+            try:
+                for prepared in prepared_exts:
+                    rv = prepared(self, value)
+                    if rv is not None:
+                        return rv
+            finally:
+                if profiler is not None:
+                    profiler.record('eval_extensions', spec.name,
+                                    default_timer() - started)
+            return self._format_field_by_base(value, spec.format_spec)
         except:
-            return self.format_error(sys.exc_info())
+            return self.format_error(sys.exc_info(),
+                                     field or self._anonymous_field(spec))
+
+    def _format_field_by_hook(self, value, spec, field=None):
+        # Formats a field by :meth:`format_field` overridden by a subclass.
+        return self.format_field(value, spec.format_spec)
+
+    def _format_field_by_base(self, value, format_spec):
+        # Formats a field by :meth:`DotNetFormatter.format_field`.
+        base = super(SmartFormatter, self)
+        profiler = self.profiler
+        if profiler is None:
+            return base.format_field(value, format_spec)
+        started = default_timer()
+        try:
+            return base.format_field(value, format_spec)
+        finally:
+            profiler.record('format_field', format_spec,
+                            default_timer() - started)
+
+    def _anonymous_field(self, spec):
+        # A field formatted by :meth:`format_field` directly.
+        return Field(u'', None, spec)
 
     def eval_extensions(self, value, name, option, format):
         """Evaluates extensions in the registry.  If some extension handles the
@@ -100,10 +654,18 @@ class SmartFormatter(DotNetFormatter):
             exts = self._extensions[name]
         except KeyError:
             raise ValueError('no suitable extension: %s' % name)
-        for ext in exts:
-            rv = ext(self, value, name, option, format)
-            if rv is not None:
-                return rv
+        profiler = self.profiler
+        if profiler is not None:
+            started = default_timer()
+        try:
+            for ext in exts:
+                rv = ext(self, value, name, option, format)
+                if rv is not None:
+                    return rv
+        finally:
+            if profiler is not None:
+                profiler.record('eval_extensions', name,
+                                default_timer() - started)
 
     def get_value(self, field_name, args, kwargs):
         if not field_name:
@@ -111,38 +673,26 @@ class SmartFormatter(DotNetFormatter):
             field_name = 0
         return super(SmartFormatter, self).get_value(field_name, args, kwargs)
 
-    def _vformat(self, format_string, _1, _2, _3,
-                 recursion_depth, *args, **kwargs):
-        if recursion_depth != 2:
-            # Don't format recursive format strings such as `{:12{this}34}`.
-            if VFORMAT_RETURNS_TUPLE:
-                return (format_string, False)
-            else:
-                return format_string
-        base = super(SmartFormatter, self)
-        return base._vformat(format_string, _1, _2, _3, 1, *args, **kwargs)
-
-    def format_error(self, exc_info):
+    def format_error(self, exc_info, field):
         raise NotImplementedError('will be set by __init__')
 
-    def _format_error_for_strict_error_action(self, exc_info):
+    def _format_error_for_strict_error_action(self, exc_info, field):
         reraise(*exc_info)
 
-    def _format_error_for_errmsg_error_action(self, exc_info):
+    def _format_error_for_errmsg_error_action(self, exc_info, field):
         __, exc, __ = exc_info
         return text_type(exc)
 
-    def _format_error_for_ignore_error_action(self, exc_info):
+    def _format_error_for_ignore_error_action(self, exc_info, field):
         return u''
 
-    def _format_error_for_skip_error_action(self, exc_info):
-        __, field_name, format_spec, conversion = self._parsed
+    def _format_error_for_skip_error_action(self, exc_info, field):
         buf = io.StringIO()
-        buf.write(u'{%s' % field_name)
-        if conversion:
-            buf.write(u'!%s' % conversion)
-        if format_spec:
-            buf.write(u':%s' % format_spec)
+        buf.write(u'{%s' % field.field_name)
+        if field.conversion:
+            buf.write(u'!%s' % field.conversion)
+        if field.spec.format_spec:
+            buf.write(u':%s' % field.spec.format_spec)
         buf.write(u'}')
         return buf.getvalue()
 
@@ -157,12 +707,6 @@ class SmartFormatter(DotNetFormatter):
         'skip': _format_error_for_skip_error_action,
     }
 
-    def _parse_for_skip_error_action(self, format_string):
-        for parsed in super(SmartFormatter, self).parse(format_string):
-            self._parsed = parsed
-            yield parsed
-            del self._parsed
-
 
 ERROR_ACTIONS = list(SmartFormatter._error_formatters.keys())
 
@@ -171,29 +715,71 @@ class Extension(object):
     """A formatter extension which wraps a function.  It works like a wrapped
     function but has several specific attributes and methods.
 
-    A funciton to be an extension takes `(name, option, format)`.  The funcion
-    should return a string as the result or ``None`` to pass to format a
-    string.
+    A funciton to be an extension takes `(formatter, value, name, option,
+    format)`.  The funcion should return a string as the result or ``None``
+    to pass to format a string.
+
+    An extension may have a preparing function which takes `(formatter, name,
+    option, format)` when a template is compiled.  It should return a
+    function which takes `(formatter, value)` or ``None`` if the extension
+    never formats the format spec.  The function is called for each value
+    instead of the extension function.  The function may have a `stream`
+    attribute to stream its result.  See
+    :meth:`SmartFormatter.iter_field_by_spec` for the details.
+
+    Prepared extensions are shared by the formatters made by
+    :meth:`SmartFormatter.with_locale`.  So they should take the locale from
+    the formatter which calls them rather than the preparing formatter.
+
+    If `types` is given, the extension is called only for instances of the
+    types.  It helps the formatter to skip extensions which share a name.
+
+    A `pure` extension returns the same result for the same formatter locale,
+    value and spec.  The results of templates which use only pure extensions
+    can be memoized.  See the `result_cache_size` parameter of
+    :class:`SmartFormatter`.
 
     To make an extension, use `@extension` decorator.
 
     """
 
-    def __init__(self, function, names):
+    def __init__(self, function, names, prepare=None, types=None,
+                 pure=False):
         self.function = function
         self.names = names
+        self.types = types
+        self.pure = pure
+        self._prepare = prepare
 
     def __call__(self, *args, **kwargs):
         return self.function(*args, **kwargs)
 
+    def prepare(self, formatter, name, option, format):
+        """Prepares the extension for a format spec.  Returns a function which
+        takes `(formatter, value)` or ``None``.
+        """
+        if self._prepare is not None:
+            return self._prepare(formatter, name, option, format)
+        function = self.function
+
+        def prepared(formatter, value):
+            return function(formatter, value, name, option, format)
+        return prepared
+
 
-def extension(names):
-    """Makes a function to be an extension."""
+def extension(names, prepare=None, types=None, pure=False):
+    """Makes a function to be an extension.  `prepare` is an optional
+    function to prepare the extension when a template is compiled.  `types`
+    is an optional tuple of the value types which the extension accepts.
+    `pure` tells that the extension has no side effect.
+    """
     for name in names:
         if not NAME_PATTERN.match(name):
             raise ValueError('invalid extension name: %s' % name)
+
     def decorator(f, names=names):
-        return Extension(f, names=names)
+        return Extension(f, names=names, prepare=prepare, types=types,
+                         pure=pure)
     return decorator
 
 
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+   smartformat.template
+   ~~~~~~~~~~~~~~~~~~~~
+
+   Compiled templates.  A compiled template keeps the parsed structure of a
+   format string so that it can be rendered many times without parsing.
+
+   :copyright: (c) 2016 by What! Studio
+   :license: BSD, see LICENSE for more details.
+
+"""
+from six import integer_types
+
+from .utils import compile_field_name
+
+
+__all__ = ['Field', 'Spec', 'Template']
+
+
+class Spec(object):
+    """A parsed format spec of a replacement field.  `name`, `option` and
+    `format` are the extension name, the extension option and the format
+    string for the extension.  `extensions` is a tuple of the prepared
+    extensions or ``None`` if there's no extension for the name.  `types`
+    is a tuple of the value types which each prepared extension accepts.
+    ``None`` in `types` means any type.
+    """
+
+    __slots__ = ('format_spec', 'name', 'option', 'format', 'extensions',
+                 'types', '_typed', '_dispatch')
+
+    def __init__(self, format_spec, name, option, format,
+                 extensions=(), types=None):
+        self.format_spec = format_spec
+        self.name = name
+        self.option = option
+        self.format = format
+        if extensions is None:
+            self.extensions = None
+        else:
+            self.extensions = tuple(extensions)
+        if types is None and extensions is not None:
+            types = (None,) * len(self.extensions)
+        self.types = types
+        self._typed = types is not None and \
+            any(t is not None for t in types)
+        self._dispatch = {}
+
+    def dispatch(self, value):
+        """Gets the prepared extensions which may format the value.  The
+        result is memoized by the type of the value.
+        """
+        extensions = self.extensions
+        if not self._typed:
+            return extensions
+        cls = type(value)
+        try:
+            return self._dispatch[cls]
+        except KeyError:
+            pass
+        extensions = tuple(ext for ext, types in zip(extensions, self.types)
+                           if types is None or issubclass(cls, types))
+        self._dispatch[cls] = extensions
+        return extensions
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.format_spec)
+
+
+class Field(object):
+    """A replacement field in a compiled template.  The field name is split
+    into `first`, the positional index or the keyword of the argument, and
+    `accessors` to look up the attributes and the items of the argument.
+
+    If `direct` is ``False``, the formatter looks up the value by its
+    `get_field` method instead.
+    """
+
+    __slots__ = ('field_name', 'conversion', 'spec', 'first', 'accessors',
+                 'direct')
+
+    def __init__(self, field_name, conversion, spec, direct=True):
+        self.field_name = field_name
+        self.conversion = conversion
+        self.spec = spec
+        self.direct = direct
+        first, self.accessors = compile_field_name(field_name)
+        # `{}` is same with `{0}`.
+        self.first = first if first != u'' else 0
+
+    def get_value(self, args, kwargs):
+        """Looks up the value of the field from the arguments."""
+        first = self.first
+        if isinstance(first, integer_types):
+            value = args[first]
+        else:
+            value = kwargs[first]
+        for accessor in self.accessors:
+            value = accessor(value)
+        return value
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.field_name)
+
+
+class Template(object):
+    """A compiled format string.  It consists of chunks.  Each chunk is a pair
+    of a literal text and a :class:`Field` or ``None``.  If the template has
+    no replacement field, `literal` is the whole text.  Otherwise, it is
+    ``None``.
+
+    `pure` is ``True`` if the template and its nested templates use only pure
+    extensions.  The results of a pure template may be memoized by the
+    formatter.  See :meth:`SmartFormatter.set_memoize` to override it.
+
+    Don't make a template directly.  Use :meth:`SmartFormatter.compile`
+    instead.
+    """
+
+    __slots__ = ('formatter', 'format_string', 'chunks', 'literal', 'pure')
+
+    def __init__(self, formatter, format_string, chunks, pure=False):
+        self.formatter = formatter
+        self.format_string = format_string
+        self.chunks = tuple(chunks)
+        self.pure = pure
+        if not self.chunks:
+            self.literal = u''
+        elif len(self.chunks) == 1 and self.chunks[0][1] is None:
+            self.literal = self.chunks[0][0]
+        else:
+            self.literal = None
+
+    def bind(self, formatter):
+        """Makes the same template which is rendered by another formatter."""
+        template = object.__new__(type(self))
+        template.formatter = formatter
+        template.format_string = self.format_string
+        template.chunks = self.chunks
+        template.literal = self.literal
+        template.pure = self.pure
+        return template
+
+    def render(self, *args, **kwargs):
+        """Formats the template with the formatter which compiled it."""
+        return self.formatter.vrender(self, args, kwargs)
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.format_string)
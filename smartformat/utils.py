@@ -7,11 +7,328 @@
    :license: BSD, see LICENSE for more details.
 
 """
+from collections import namedtuple, OrderedDict
+import decimal
+import functools
+from operator import attrgetter, itemgetter
+import threading
+
 from babel import Locale
-from babel.plural import _fallback_tag, _plural_tags
+from babel.numbers import (
+    get_decimal_symbol, get_group_symbol, NumberPattern,
+    parse_pattern as _parse_pattern)
+from babel.plural import (
+    _fallback_tag, _plural_tags, _PythonCompiler, cldr_modulo,
+    extract_operands, in_range_list, within_range_list)
+from six import integer_types
+
+try:
+    from _string import formatter_field_name_split
+except ImportError:
+    def formatter_field_name_split(field_name):
+        return field_name._formatter_field_name_split()
+
+
+__all__ = ['cached', 'CacheInfo', 'compile_field_name', 'compile_plural_rule',
+           'get_number_pattern',
+           'get_plural_tag_index', 'get_plural_tag_indexer', 'LRUCache',
+           'modify_number_pattern', 'parse_locale', 'parse_pattern',
+           'PluralTagIndexer', 'PreparedPattern']
+
+
+#: The statistics of an :class:`LRUCache`.
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions',
+                                     'maxsize', 'currsize'])
+
+
+class LRUCache(object):
+    """A thread-safe mapping which discards the least recently used item when
+    it is full.  If `maxsize` is ``None``, the cache grows without bound.  If
+    `maxsize` is 0, the cache keeps nothing.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        """Gets the cached value of the key.  If the key is not cached,
+        returns `default`.
+        """
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Mark as the most recently used.
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Caches a value for the key."""
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if self.maxsize is None:
+                return
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Discards all cached items and resets the statistics."""
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        """Reports the statistics as a :data:`CacheInfo`."""
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                             self.maxsize, len(self._items))
+
+    def items(self):
+        """Returns a list of the cached items from the least recently used
+        one.  It doesn't affect the order and the statistics.
+        """
+        with self._lock:
+            return list(self._items.items())
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+_missing = object()
+
+
+def cached(cache):
+    """Makes a function cache its results by the arguments in a cache such as
+    :class:`LRUCache`.  The arguments should be hashable.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            key = args
+            if kwargs:
+                key += tuple(sorted(kwargs.items()))
+            rv = cache.get(key, _missing)
+            if rv is _missing:
+                rv = f(*args, **kwargs)
+                cache.set(key, rv)
+            return rv
+        wrapped.cache = cache
+        return wrapped
+    return decorator
+
+
+def compile_field_name(field_name):
+    """Splits a field name such as ``user.profile.name`` or ``items[0]``
+    into the first key and a tuple of accessors.  Each accessor takes an
+    object and returns the attribute or the item of it.  Consecutive
+    attributes are looked up by an accessor.
+    """
+    first, rest = formatter_field_name_split(field_name)
+    accessors, attrs = [], []
+    for is_attr, key in rest:
+        if is_attr:
+            attrs.append(key)
+            continue
+        if attrs:
+            accessors.append(attrgetter(u'.'.join(attrs)))
+            del attrs[:]
+        accessors.append(itemgetter(key))
+    if attrs:
+        accessors.append(attrgetter(u'.'.join(attrs)))
+    return first, tuple(accessors)
+
+
+@cached(LRUCache(256))
+def parse_locale(locale):
+    """Same with :meth:`babel.Locale.parse` but cached."""
+    return Locale.parse(locale)
+
+
+@cached(LRUCache(1024))
+def parse_pattern(pattern):
+    """Same with :func:`babel.numbers.parse_pattern` but cached."""
+    return _parse_pattern(pattern)
 
 
-__all__ = ['get_plural_tag_index']
+def modify_number_pattern(number_pattern, **kwargs):
+    """Modifies a number pattern by specified keyword arguments."""
+    params = ['pattern', 'prefix', 'suffix', 'grouping',
+              'int_prec', 'frac_prec', 'exp_prec', 'exp_plus']
+    for param in params:
+        if param in kwargs:
+            continue
+        kwargs[param] = getattr(number_pattern, param)
+    return NumberPattern(**kwargs)
+
+
+@cached(LRUCache(1024))
+def get_number_pattern(locale, format_type, **kwargs):
+    """Gets the standard number pattern of a locale.  `format_type` is one of
+    ``'decimal'``, ``'percent'`` and ``'currency'``.  If keyword arguments are
+    given, the pattern is modified by :func:`modify_number_pattern`.
+    """
+    locale = parse_locale(locale)
+    if format_type == 'currency':
+        pattern = locale.currency_formats['standard']
+    else:
+        pattern = getattr(locale, format_type + '_formats').get(None)
+    if kwargs:
+        pattern = modify_number_pattern(pattern, **kwargs)
+    return pattern
+
+
+class PreparedPattern(object):
+    """A number pattern prepared for a locale.  Calling it renders a number
+    same with ``pattern.apply(value, locale, force_frac=frac_prec)`` but the
+    locale symbols and the pattern attributes are looked up only once.
+
+    Scientific and significant digits patterns are not prepared.  They are
+    applied by :meth:`babel.numbers.NumberPattern.apply` as it is.
+    """
+
+    __slots__ = ('pattern', 'locale', 'frac_prec', 'quantum', 'scale',
+                 'group_symbol', 'decimal_symbol', 'supported')
+
+    def __init__(self, pattern, locale, frac_prec=None):
+        self.pattern = pattern
+        self.locale = locale
+        self.frac_prec = frac_prec or pattern.frac_prec
+        self.quantum = decimal.Decimal(10) ** -self.frac_prec[1]
+        self.scale = getattr(pattern, 'scale', 0)
+        self.group_symbol = get_group_symbol(locale)
+        self.decimal_symbol = get_decimal_symbol(locale)
+        self.supported = not pattern.exp_prec and u'@' not in pattern.pattern
+
+    def __call__(self, value):
+        if not self.supported:
+            return self.pattern.apply(value, self.locale,
+                                      force_frac=self.frac_prec)
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value))
+        value = value.scaleb(self.scale)
+        is_negative = int(value.is_signed())
+        value = abs(value).normalize()
+        integer, __, fraction = \
+            u'{0:f}'.format(value.quantize(self.quantum)).partition(u'.')
+        pattern = self.pattern
+        return u''.join([pattern.prefix[is_negative],
+                         self._format_int(integer),
+                         self._format_frac(fraction or u'0'),
+                         pattern.suffix[is_negative]])
+
+    def _format_int(self, value):
+        min_ = self.pattern.int_prec[0]
+        if len(value) < min_:
+            value = u'0' * (min_ - len(value)) + value
+        gsize, next_gsize = self.pattern.grouping
+        if len(value) <= gsize:
+            return value
+        groups = []
+        while len(value) > gsize:
+            groups.append(value[-gsize:])
+            value = value[:-gsize]
+            gsize = next_gsize
+        groups.append(value)
+        groups.reverse()
+        return self.group_symbol.join(groups)
+
+    def _format_frac(self, value):
+        min_, max_ = self.frac_prec
+        if len(value) < min_:
+            value += u'0' * (min_ - len(value))
+        if max_ == 0 or (min_ == 0 and int(value) == 0):
+            return u''
+        value = value[:min_] + value[min_:].rstrip(u'0')
+        return self.decimal_symbol + value
+
+
+#: Plural tag indices of integers whose absolute values are less than it are
+#: memoized.  Change it before formatting to configure the range.
+PLURAL_MEMO_SIZE = 10000
+
+
+def compile_plural_rule(plural_rule, indices):
+    """Compiles a plural rule into 2 Python functions which return the plural
+    tag index of a number directly.  The first one is specialized for
+    integers.  The second one takes any number.
+    """
+    compile_ = _PythonCompiler().compile
+    conditions = [' if (%s): return %d' % (compile_(ast), indices[tag])
+                  for tag, ast in plural_rule.abstract]
+    fallback = ' return %d' % indices[_fallback_tag]
+    code = '\n'.join([
+        'def evaluate_int(n):',
+        ' n = i = abs(n)',
+        ' v = w = f = t = c = e = 0',
+    ] + conditions + [fallback] + [
+        'def evaluate(n):',
+        # Older Babel extracts only 6 operands.
+        ' n, i, v, w, f, t, c, e = (extract_operands(n) + (0, 0))[:8]',
+    ] + conditions + [fallback])
+    namespace = {'IN': in_range_list, 'WITHIN': within_range_list,
+                 'MOD': cldr_modulo, 'extract_operands': extract_operands}
+    eval(compile(code, '<plural rule>', 'exec'), namespace)
+    return namespace['evaluate_int'], namespace['evaluate']
+
+
+class PluralTagIndexer(object):
+    """Gets plural tag indices on the plural rule of a locale.  The plural
+    rule is compiled into Python functions and the indices of integers are
+    memoized.
+    """
+
+    __slots__ = ('plural_rule', 'indices', 'memo', 'memo_size',
+                 '_evaluate_int', '_evaluate')
+
+    def __init__(self, plural_rule, memo_size=None):
+        used_tags = plural_rule.tags | set([_fallback_tag])
+        self.plural_rule = plural_rule
+        self.indices = {}
+        for tag in _plural_tags:
+            if tag in used_tags:
+                self.indices[tag] = len(self.indices)
+        self.memo = {}
+        self.memo_size = PLURAL_MEMO_SIZE if memo_size is None else memo_size
+        self._evaluate_int, self._evaluate = \
+            compile_plural_rule(plural_rule, self.indices)
+
+    def __call__(self, number):
+        if not isinstance(number, integer_types):
+            return self._evaluate(number)
+        n = abs(number)
+        try:
+            return self.memo[n]
+        except KeyError:
+            index = self._evaluate_int(n)
+            if n < self.memo_size:
+                self.memo[n] = index
+            return index
+
+
+_plural_tag_indexers = {}
+
+
+def get_plural_tag_indexer(locale):
+    """Gets the cached :class:`PluralTagIndexer` of a locale."""
+    try:
+        return _plural_tag_indexers[locale]
+    except KeyError:
+        plural_rule = Locale.parse(locale).plural_form
+        indexer = _plural_tag_indexers[locale] = PluralTagIndexer(plural_rule)
+        return indexer
 
 
 def get_plural_tag_index(number, locale):
@@ -25,12 +342,4 @@ def get_plural_tag_index(number, locale):
        1
 
     """
-    locale = Locale.parse(locale)
-    plural_rule = locale.plural_form
-    used_tags = plural_rule.tags | set([_fallback_tag])
-    tag, index = plural_rule(number), 0
-    for _tag in _plural_tags:
-        if _tag == tag:
-            return index
-        if _tag in used_tags:
-            index += 1
+    return get_plural_tag_indexer(locale)(number)
@@ -1,13 +1,29 @@
 # -*- coding: utf-8 -*-
+import array
 from datetime import date
+from decimal import Decimal
+import io
+import threading
 
 from babel import Locale, UnknownLocaleError
+from babel.plural import _fallback_tag, _plural_tags
 import pytest
 from six import python_2_unicode_compatible
 
+from smartformat.builtin import prepare_list
+from smartformat.bulk import format_numbers
 from smartformat.dotnet import DotNetFormatter
+from smartformat.dotnet import get_field_renderer as get_dotnet_field_renderer
+from smartformat.dotnet import (
+    get_float_pattern, prepare_currency_pattern, prepare_scientific_pattern)
+from smartformat.local import get_field_renderer as get_local_field_renderer
 from smartformat.local import LocalFormatter
-from smartformat.smart import SmartFormatter
+from smartformat.parallel import get_config
+from smartformat.profiler import Profiler
+from smartformat.smart import extension, SmartFormatter
+from smartformat.utils import (
+    get_number_pattern, get_plural_tag_index, parse_locale, parse_pattern,
+    PluralTagIndexer)
 
 
 class Gender(object):
@@ -54,6 +70,16 @@ class Person(object):
         return self.parse_name()[2]
 
 
+class DefaultFormatter(SmartFormatter):
+    """Formats missing fields as ``?``."""
+
+    def get_value(self, key, args, kwargs):
+        try:
+            return super(DefaultFormatter, self).get_value(key, args, kwargs)
+        except (IndexError, KeyError):
+            return u'?'
+
+
 @pytest.fixture
 def michael():
     michael = Person(u'Michael Scott', Gender.male, date(1970, 3, 3),
@@ -108,6 +134,8 @@ class TestLocalFormatter(TestFormatter):
         assert self.format('hi_IN', u'{0:,d}', 123456789) == u'12,34,56,789'
         assert self.format('hi_IN', u'{0:+,d}', 123456789) == u'+12,34,56,789'
         assert self.format('hi_IN', u'{0: ,d}', 123456789) == u' 12,34,56,789'
+        assert self.format('hi_IN', u'{0:.2f}', 123456789) == u'123456789.00'
+        assert self.format('fr_FR', u'{0:.0%}', 12345) == u'1234500%'
 
     def test_float(self):
         assert \
@@ -138,6 +166,27 @@ class TestLocalFormatter(TestFormatter):
             self.format('ru_RU', u'{0:020,%}', 12345) == \
             u'0001\xa0234\xa0500,000000%'
 
+    def test_backward_compatibility(self):
+        from smartformat import dotnet, local, utils
+        assert local.modify_number_pattern is utils.modify_number_pattern
+        assert dotnet.modify_number_pattern is utils.modify_number_pattern
+        assert local.remove_group_symbols(u'1,234,567', 'en_US') == \
+            u'1234567'
+
+    def test_format_field_by_match(self):
+        class MatchFormatter(LocalFormatter):
+
+            def format_field_by_match(self, value, match):
+                if match.group('type') == u'f':
+                    return u'MATCH'
+                return super(MatchFormatter, self).format_field_by_match(
+                    value, match)
+
+        formatter = MatchFormatter('en_US')
+        assert formatter.format(u'{0:.2f}', 1) == u'MATCH'
+        assert formatter.format(u'{0:,d}', 1234) == u'1,234'
+        assert formatter.format(u'{0}', 1) == u'1'
+
 
 class TestDotNetFormatter(TestFormatter):
 
@@ -153,6 +202,29 @@ class TestDotNetFormatter(TestFormatter):
         assert self.format('fr_FR', u'{0:c3}', -123.456) == u'-123,456\xa0€'
         assert self.format('ja_JP', u'{0:c3}', -123.456) == u'-￥123.456'
 
+    def test_pinned_currency(self):
+        formatter = DotNetFormatter('en_US', currency='EUR')
+        assert formatter.format(u'{0:c}', 123.456) == u'€123.46'
+        assert formatter.format(u'{0:c3}', 123.456) == u'€123.456'
+        formatter = DotNetFormatter('ja_JP', currency='USD')
+        assert formatter.format(u'{0:c}', 123.456) == u'$123.46'
+        smart = SmartFormatter('fr_FR', currency='KRW')
+        assert smart.format(u'{0:c}', 1234) == u'1\u202f234\xa0₩'
+
+    def test_overridden_format_field(self):
+        def format_field(spec, arg, value, locale):
+            if spec == u'z':
+                return u'ZZ'
+            return DotNetFormatter._format_field(spec, arg, value, locale)
+
+        class ZFormatter(DotNetFormatter):
+            _format_field = staticmethod(format_field)
+
+        formatter = ZFormatter('en_US')
+        assert formatter.format(u'{0:z}', 1) == u'ZZ'
+        assert formatter.format(u'{0:d6}', -1234) == u'-001234'
+        assert formatter.format(u'{0}', 1) == u'1'
+
     def test_decimal(self):
         assert self.format(u'{0:d}', 1234) == u'1234'
         assert self.format(u'{0:d6}', -1234) == u'-001234'
@@ -231,6 +303,70 @@ class TestDotNetFormatter(TestFormatter):
     def test_unknown_spec(self):
         assert self.format(u'~!{0:\x00}!~', 'Smart') == u'~!Smart!~'
 
+    def test_cache(self):
+        assert parse_locale('fr_FR') is parse_locale('fr_FR')
+        assert parse_pattern(u'0.00') is parse_pattern(u'0.00')
+        pattern = get_number_pattern('fr_FR', 'currency', frac_prec=(3, 3))
+        assert pattern.frac_prec == (3, 3)
+        assert pattern is \
+            get_number_pattern('fr_FR', 'currency', frac_prec=(3, 3))
+        assert pattern is not get_number_pattern('fr_FR', 'currency')
+        assert self.format('fr_FR', u'{0:c3}', 1) == u'1,000\xa0€'
+        fr = parse_locale('fr_FR')
+        render = get_dotnet_field_renderer(u'n2', fr)
+        assert render is get_dotnet_field_renderer(u'n2', fr)
+        assert render(1234.5) == u'1\u202f234,50'
+        render = get_dotnet_field_renderer(u'c', fr, 'USD')
+        assert render(1) == u'1,00\xa0$US'
+        # The default currency is resolved when the renderer is made.
+        render = get_dotnet_field_renderer(u'c', fr)
+        assert render.args[0] is prepare_currency_pattern(fr, 'EUR', None)
+        assert render(-1234.5) == u'-1\u202f234,50\xa0€'
+        assert get_dotnet_field_renderer(u'c0', parse_locale('ja_JP'))(
+            Decimal('1234.5')) == u'￥1,234'
+        render = get_local_field_renderer(u'^12,.1f', fr)
+        assert render is get_local_field_renderer(u'^12,.1f', fr)
+        assert render(1234.5) == u'  1\u202f234,5   '
+        assert render(float('nan')) is None
+        assert get_local_field_renderer(u'x', fr) is None
+        render = get_dotnet_field_renderer(u'e3', fr)
+        assert render is prepare_scientific_pattern(u'e', u'3', fr)
+        assert render(1234.5) == u'1,234e+003'
+        render = get_dotnet_field_renderer(u'#,##0.0', fr)
+        assert render(1234.56) == u'1\u202f234,6'
+        assert render(u'abc') == u'abc'
+        assert get_float_pattern(u'3') is get_float_pattern(u'3')
+
+
+class TestBulk(object):
+
+    numbers = [0, 1, -1, 0.005, -0.004, 2.675, 1234.5678, -98765.4321,
+               123456789, 10 ** 12 + 1, Decimal('1.235'), 1e-9]
+
+    @pytest.mark.parametrize('locale', ['en_US', 'hi_IN', 'fr_FR', 'de_CH'])
+    @pytest.mark.parametrize('format_spec', [
+        u'n', u'n0', u'N3', u'p', u'p1', u'f', u'f4', u'e2', u'0.##',
+    ])
+    def test_same(self, locale, format_spec):
+        formatter = DotNetFormatter(locale)
+        expected = [formatter.format_field(n, format_spec)
+                    for n in self.numbers]
+        assert format_numbers(format_spec, self.numbers, locale) == expected
+
+    def test_buffer(self):
+        numbers = array.array('d', [1.25, -2.5])
+        assert format_numbers(u'n1', numbers, 'en_US') == [u'1.2', u'-2.5']
+        numbers = array.array('l', [12, -34])
+        assert format_numbers(u'd4', numbers, 'en_US') == [u'0012', u'-0034']
+
+    def test_numpy(self):
+        numpy = pytest.importorskip('numpy')
+        numbers = numpy.array([1234.5, -0.125])
+        assert \
+            format_numbers(u'n2', numbers, 'en_US') == [u'1,234.50', u'-0.12']
+        numbers = numpy.array([0.1], dtype=numpy.float32)
+        assert format_numbers(u'n2', numbers, 'en_US') == [u'0.10']
+
 
 class TestSmartFormatter(TestFormatter):
 
@@ -316,6 +452,24 @@ class TestPlural(TestSmartFormatter):
                          u'{0:plural(pl):miesiąc|miesiące|miesięcy}')
         assert self.format(None, format_string, 2) == u'2 many 많이 miesiące'
 
+    @pytest.mark.parametrize('locale', ['en_US', 'ru_RU', 'ar', 'pl', 'lv'])
+    def test_plural_tag_index(self, locale):
+        plural_rule = Locale.parse(locale).plural_form
+        indices = {}
+        for tag in _plural_tags:
+            if tag in plural_rule.tags | set([_fallback_tag]):
+                indices[tag] = len(indices)
+        numbers = list(range(-5, 1234)) + [10 ** 9 + 1, 2.0, 1.5, 0.25]
+        for n in numbers:
+            expected = indices[plural_rule(n)]
+            assert get_plural_tag_index(n, locale) == expected
+            assert get_plural_tag_index(Decimal(n), locale) == expected
+
+    def test_plural_tag_indexer_memo(self):
+        indexer = PluralTagIndexer(Locale.parse('ru_RU').plural_form, 100)
+        assert [indexer(n) for n in [1, 2, 5, -21, 121]] == [0, 1, 2, 0, 0]
+        assert sorted(indexer.memo) == [1, 2, 5, 21]
+
 
 class TestChoose(TestSmartFormatter):
 
@@ -420,6 +574,36 @@ class TestList(TestSmartFormatter):
         self.assert_format(u'{0:({})|, |, and }', args,
                            u'(A), (B), (C), (D), and (E)')
 
+    def test_iterable(self):
+        x = self.assert_format
+        x(u'{0:{}|, |, and | and }', iter([]), u'')
+        x(u'{0:{}|, |, and | and }', iter([1]), u'1')
+        x(u'{0:{}|, |, and | and }', iter([1, 2]), u'1 and 2')
+        x(u'{0:{}|, |, and | and }', (x for x in range(1, 5)),
+          u'1, 2, 3, and 4')
+        x(u'{0:{index}:{}|, }', (x * x for x in range(4)),
+          u'0:0, 1:1, 2:4, 3:9')
+        smart = SmartFormatter('en_US')
+        items = (x for x in range(100000))
+        chunks = smart.iter_render(u'{0:{}|, }', items)
+        assert [next(chunks) for x in range(3)] == [u'0', u', ', u'1']
+        # Not consumed entirely.
+        assert next(items) < 10
+
+    def test_sequence_protocol(self):
+        class Seq(object):
+            def __getitem__(self, x):
+                if x >= 3:
+                    raise IndexError(x)
+                return x + 7
+        smart = SmartFormatter('en_US')
+        list_ = prepare_list(smart, u'list', None, u'{}|, ')
+        assert u''.join(list_.stream(smart, Seq())) == u'7, 8, 9'
+        assert list_.stream(smart, 42) is None
+        assert list_.stream(smart, u'abc') is None
+        self.assert_format(u'{0:list:{}|, }', Seq(), u'7, 8, 9')
+        self.assert_format(u'{0:{}|, }', Seq(), u'7, 8, 9')
+
     @pytest.mark.xfail
     def test_nested_array(self, args):
         self.assert_format(u'{2:{:{first_name}}|, }', args,
@@ -482,5 +666,570 @@ class TestError(TestSmartFormatter):
             u'!no suitable extension: __!'
         assert s('skip').format(u'!{0:__:}!', 42) == u'!{0:__:}!'
 
+    def test_nested_skip_error_action(self):
+        smart = SmartFormatter(errors='skip')
+        assert \
+            smart.format(u'{0:[{:__:}]|, } {1:__:}', [1, 2], 3) == \
+            u'[{:__:}], [{:__:}] {1:__:}'
+        assert smart.format_field(42, u'__:') == u'{:__:}'
+
+    def test_concurrent_skip_error_action(self):
+        smart = SmartFormatter('en_US', errors='skip')
+        template = u'{0:{}|, } {1:__:} {2:an item|{} items} {3:__:}'
+        expected = u'1, 2, 3 {1:__:} 2 items {3:__:}'
+        results = []
+
+        def render():
+            for x in range(200):
+                results.append(smart.format(template, [1, 2, 3], 0, 2, 0))
+        threads = [threading.Thread(target=render) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [expected] * 1600
+
     def test_brace_escaping(self):
         assert self.format(u'{{0}} {{{0}}} {{}}', u'Zero') == u'{0} {Zero} {}'
+
+
+class TestCompile(TestSmartFormatter):
+
+    def test_render(self):
+        smart = SmartFormatter('en_US')
+        template = smart.compile(u'There {0:is an item|are {} items}.')
+        assert template.render(1) == u'There is an item.'
+        assert template.render(42) == u'There are 42 items.'
+        assert template.render(42) == smart.format(template.format_string, 42)
+
+    def test_chunks(self):
+        smart = SmartFormatter('en_US')
+        template = smart.compile(u'{{A}} {0.real!r:B} {{C}}')
+        (text1, field), (text2, end) = template.chunks
+        assert text1 == u'{A} '
+        assert field.field_name == u'0.real'
+        assert field.conversion == u'r'
+        assert field.spec.format_spec == u'B'
+        assert text2 == u' {C}'
+        assert end is None
+        assert template.render(42) == u'{A} 42 {C}'
+
+    def test_parsed_spec(self):
+        smart = SmartFormatter('en_US')
+        template = smart.compile(u'{0:choose(1|2):one|two}')
+        spec = template.chunks[0][1].spec
+        assert spec.name == u'choose'
+        assert spec.option == u'1|2'
+        assert spec.format == u'one|two'
+
+    def test_field_path(self):
+        smart = SmartFormatter('en_US')
+        template = smart.compile(u'{0.real.imag} {items[1][x].real} {}')
+        field = template.chunks[0][1]
+        assert field.first == 0
+        assert len(field.accessors) == 1
+        field = template.chunks[1][1]
+        assert field.first == u'items'
+        assert len(field.accessors) == 3
+        assert template.chunks[2][1].first == 0
+        items = [None, {u'x': 42}]
+        assert template.render(1.5, items=items) == u'0.0 42 1.5'
+        with pytest.raises(KeyError):
+            template.render(1.5)
+        with pytest.raises(AttributeError):
+            smart.format(u'{0.foo}', 1)
+        with pytest.raises(NotImplementedError):
+            smart.compile(u'{0,10}')
+
+    def test_overridden_get_value(self):
+        smart = DefaultFormatter('en_US')
+        template = smart.compile(u'{missing} {0.real} {1:item|items}')
+        assert not any(field.direct for __, field in template.chunks)
+        assert template.render(42, 2) == u'? 42 items'
+        assert u''.join(smart.iter_render(template, 42)) == u'? 42 ?'
+        assert SmartFormatter('en_US').compile(u'{0}').chunks[0][1].direct
+
+    def test_overridden_format_field(self):
+        class UpperFormatter(SmartFormatter):
+
+            def format_field(self, value, format_spec):
+                if format_spec == u'upper':
+                    return value.upper()
+                return super(UpperFormatter, self).format_field(
+                    value, format_spec)
+
+        smart = UpperFormatter('en_US')
+        assert smart.format(u'{0:upper} {1:item|items}', u'abc', 2) == \
+            u'ABC items'
+        assert not smart.compile(u'{0:upper}').pure
+        chunks = smart.iter_render(u'{0:upper} {1:{}|, }', u'abc', [1, 2])
+        assert u''.join(chunks) == u'ABC 1, 2'
+
+    def test_overridden_eval_extensions(self):
+        class ShoutFormatter(SmartFormatter):
+
+            def eval_extensions(self, value, name, option, format):
+                if name == u'shout':
+                    return value.upper() + u'!'
+                return super(ShoutFormatter, self).eval_extensions(
+                    value, name, option, format)
+
+        smart = ShoutFormatter('en_US')
+        assert smart.format(u'{0:shout:} {1:item|items}', u'hi', 2) == \
+            u'HI! items'
+        assert u''.join(smart.iter_render(u'{0:shout:}', u'hi')) == u'HI!'
+        with pytest.raises(ValueError):
+            smart.format(u'{0:unknown:}', 1)
+
+    def test_overridden_check_unused_args(self):
+        checked = []
+
+        class StrictFormatter(SmartFormatter):
+
+            def check_unused_args(self, used_args, args, kwargs):
+                checked.append(used_args)
+                unused = set(kwargs) - used_args
+                if unused:
+                    raise ValueError('unused arguments: %r' % unused)
+
+        smart = StrictFormatter('en_US')
+        assert smart.format(u'{0} {name}', 1, name=u'x') == u'1 x'
+        assert checked == [set([0, u'name'])]
+        with pytest.raises(ValueError):
+            smart.format(u'{0}', 1, name=u'x')
+
+    def test_literal(self):
+        smart = SmartFormatter('en_US')
+        assert smart.format(u'Hello, world!') == u'Hello, world!'
+        assert smart.cache_info().misses == 0
+        template = smart.compile(u'{{Hello}}, {{world}}!')
+        assert template.literal == u'{Hello}, {world}!'
+        assert template.render() == u'{Hello}, {world}!'
+        assert u''.join(smart.iter_render(template)) == u'{Hello}, {world}!'
+        assert smart.compile(u'').literal == u''
+        assert smart.compile(u'{0}!').literal is None
+        with pytest.raises(ValueError):
+            smart.format(u'Hello}')
+        # Literal branches.
+        assert smart.format(u'{0:is an item|are {} items}', 1) == \
+            u'is an item'
+        chunks = smart.iter_render(u'{0:one|many}', 1)
+        assert list(chunks) == [u'one']
+
+    def test_error_action(self):
+        smart = SmartFormatter(errors='skip')
+        template = smart.compile(u'!{0:__:}!')
+        assert template.render(42) == u'!{0:__:}!'
+        assert template.render(24) == u'!{0:__:}!'
+
+
+class TestWithLocale(TestSmartFormatter):
+
+    def test_with_locale(self):
+        smart = SmartFormatter('en_US', errors='ignore')
+        format_string = u'{0:n1} {0:банан|банана|бананов}{1:__:}'
+        ru = smart.with_locale('ru_RU')
+        assert ru.locale == Locale.parse('ru_RU')
+        assert smart.locale == Locale.parse('en_US')
+        assert ru.errors == 'ignore'
+        assert ru.format(format_string, 5, 0) == u'5,0 бананов'
+        assert ru.format(format_string, 22, 0) == u'22,0 банана'
+        # The compiled templates are shared.
+        assert smart.cache_info() == ru.cache_info()
+        template = smart.compile(u'{0:n1}')
+        assert template.render(1234) == u'1,234.0'
+        assert ru.compile(u'{0:n1}').render(1234) == u'1\xa0234,0'
+        assert template.render(1234) == u'1,234.0'
+
+    def test_register(self):
+        @extension(['hello'])
+        def hello(formatter, value, name, option, format):
+            return u'HELLO'
+        smart = SmartFormatter('en_US')
+        ko = smart.with_locale('ko_KR')
+        smart.register([hello])
+        assert smart.format(u'{0:hello:}', 1) == u'HELLO'
+        with pytest.raises(ValueError):
+            ko.format(u'{0:hello:}', 1)
+
+
+class TestFormatMany(TestSmartFormatter):
+
+    def test_format_many(self):
+        smart = SmartFormatter('en_US')
+        rows = [(1,), (2,), [42]]
+        format_string = u'{0} {0:item|items}'
+        assert smart.format_many(format_string, rows) == \
+            [u'1 item', u'2 items', u'42 items']
+        rows = [{'n': 1}, {'n': 5}]
+        results = smart.iformat_many(u'{n:an apple|{} apples}', rows)
+        assert next(results) == u'an apple'
+        assert list(results) == [u'5 apples']
+
+
+class TestStream(TestSmartFormatter):
+
+    def test_render_to(self):
+        smart = SmartFormatter('en_US')
+        buf = io.StringIO()
+        smart.render_to(buf, u'{0:{}|, |, and } ({1:an item|{} items})',
+                        [1, 2, 3], 3)
+        assert buf.getvalue() == u'1, 2, and 3 (3 items)'
+        buf = io.StringIO()
+        template = smart.compile(u'[{0:{}|, }]')
+        smart.render_to(buf, template, list(range(3)))
+        assert buf.getvalue() == u'[0, 1, 2]'
+
+    def test_iter_render(self):
+        smart = SmartFormatter('en_US')
+        chunks = smart.iter_render(u'{0:{}|, }!', [u'A', u'B', u'C'])
+        assert list(chunks) == [u'A', u', ', u'B', u', ', u'C', u'!']
+        chunks = smart.iter_render(u'{0:an item|{} items}', 2)
+        assert list(chunks) == [u'2', u' items']
+
+    def test_error_action(self):
+        smart = SmartFormatter('en_US', errors='skip')
+        chunks = smart.iter_render(u'{0:{}|, } {0:__:}', [1, 2])
+        assert u''.join(chunks) == u'1, 2 {0:__:}'
+
+    def test_error_in_stream(self):
+        def items():
+            yield 1
+            yield 2
+            raise RuntimeError('broken')
+        smart = SmartFormatter('en_US', errors='skip')
+        assert smart.format(u'[{0:{}|, }]', items()) == u'[{0:{}|, }]'
+        chunks = smart.iter_render(u'[{0:{}|, }]', items())
+        assert u''.join(chunks) == u'[{0:{}|, }]'
+        # Streamed lazily in the strict mode.
+        smart = SmartFormatter('en_US')
+        chunks = smart.iter_render(u'[{0:{}|, }]', items())
+        assert [next(chunks) for x in range(2)] == [u'[', u'1']
+        with pytest.raises(RuntimeError):
+            list(chunks)
+
+
+class TestPrepare(TestSmartFormatter):
+
+    def test_prepare(self):
+        prepared_specs = []
+
+        def prepare_hello(formatter, name, option, format):
+            prepared_specs.append((name, option, format))
+            if not option:
+                return
+
+            def hello(formatter, value):
+                return u'HELLO ' + (option if value else format)
+            return hello
+
+        @extension(['hello'], prepare=prepare_hello)
+        def hello(formatter, value, name, option, format):
+            assert False, 'should not be called'
+        smart = SmartFormatter('en_US', [hello])
+        template = smart.compile(u'{0:hello(world):earth}')
+        assert prepared_specs == [(u'hello', u'world', u'earth')]
+        assert template.render(True) == u'HELLO world'
+        assert template.render(False) == u'HELLO earth'
+        assert prepared_specs == [(u'hello', u'world', u'earth')]
+        # Skipped at the compile time.
+        assert smart.format(u'{0:hello:earth}', u'value') == u'value'
+
+    def test_types(self):
+        calls = []
+
+        @extension(['', 'num'], types=(int,))
+        def num(formatter, value, name, option, format):
+            calls.append(value)
+            return u'num'
+        smart = SmartFormatter('en_US', [num])
+        template = smart.compile(u'{0:{!s}|, }')
+        assert template.render(42) == u'num'
+        assert template.render([1, 2]) == u'1, 2'
+        # Pluralized.
+        assert template.render(42.5) == u', '
+        assert calls == [42]
+        spec = template.chunks[0][1].spec
+        assert len(spec.extensions) == 3
+        assert len(spec.dispatch([])) == 1
+
+    def test_no_prepare(self):
+        @extension(['hello'])
+        def hello(formatter, value, name, option, format):
+            return u'HELLO ' + (option if value else format)
+        smart = SmartFormatter('en_US', [hello])
+        assert smart.format(u'{0:hello(world):earth}', True) == u'HELLO world'
+        assert smart.format(u'{0:hello(world):earth}', 0) == u'HELLO earth'
+
+    def test_deferred_error(self):
+        smart = SmartFormatter('en_US', errors='ignore')
+        template = smart.compile(u'[{0:choose(1|2):one}]')
+        assert template.render(1) == u'[]'
+        with pytest.raises(ValueError):
+            SmartFormatter('en_US').compile(u'{0:choose(1|2):one}').render(1)
+
+
+class TestCache(TestSmartFormatter):
+
+    def test_cache_info(self):
+        smart = SmartFormatter('en_US')
+        smart.format(u'{0} apples', 1)
+        smart.format(u'{0} apples', 2)
+        info = smart.cache_info()
+        assert info.hits == 1
+        assert info.misses == 1
+        assert info.currsize == 1
+        assert smart.compile(u'{0}') is smart.compile(u'{0}')
+        smart.cache_clear()
+        assert smart.cache_info().currsize == 0
+
+    def test_lru(self):
+        smart = SmartFormatter('en_US', cache_size=2)
+        a = smart.compile(u'{0}A')
+        smart.compile(u'{0}B')
+        assert smart.compile(u'{0}A') is a
+        smart.compile(u'{0}C')  # evicts B.
+        assert smart.cache_info().evictions == 1
+        assert smart.compile(u'{0}A') is a
+        assert smart.format(u'{0}B', 1) == u'1B'
+        assert smart.cache_info().currsize == 2
+
+    def test_nested(self):
+        smart = SmartFormatter('en_US')
+        format_string = u'{0:an item|{} items} in {1:{}|, }'
+        smart.format(format_string, 2, [1, 2, 3])
+        info = smart.cache_info()
+        assert \
+            smart.format(format_string, 3, [4, 5]) == u'3 items in 4, 5'
+        # Nested templates are prepared by the outer template.
+        assert smart.cache_info().hits == info.hits + 1
+        assert smart.cache_info().misses == info.misses
+
+    def test_dump_templates(self, tmpdir):
+        path = str(tmpdir.join('templates.bin'))
+        smart = SmartFormatter('en_US')
+        format_string = u'{{{0}}} {0:an item|{} items} in {1:{}|, }'
+        smart.compile(format_string)
+        smart.dump_templates(path)
+        # Load without parsing.
+        de = SmartFormatter('de_DE')
+
+        def parse(format_string):
+            assert False, 'should not parse'
+        de.parse = parse
+        assert de.load_templates(path) == smart.cache_info().currsize
+        assert de.format(format_string, 2, [1, 2]) == u'{2} 2 items in 1, 2'
+        assert de.load_templates(path) == 0
+
+        # Stale files.
+        @extension(['hello'])
+        def hello(formatter, value, name, option, format):
+            return u'HELLO'
+        with pytest.raises(ValueError):
+            SmartFormatter('en_US', [hello]).load_templates(path)
+        tmpdir.join('broken.bin').write('broken')
+        with pytest.raises(ValueError):
+            smart.load_templates(str(tmpdir.join('broken.bin')))
+
+    def test_no_cache(self):
+        smart = SmartFormatter('en_US', cache_size=0)
+        assert smart.format(u'{0:item|items}', 2) == u'items'
+        assert smart.compile(u'{0}') is not smart.compile(u'{0}')
+        assert smart.cache_info().currsize == 0
+
+
+class TestProfiler(TestSmartFormatter):
+
+    def test_profiler(self):
+        profiler = Profiler()
+        smart = SmartFormatter('en_US', profiler=profiler)
+        format_string = u'{0:an item|{} items} {1:n2}'
+        assert smart.format(format_string, 1, 2) == u'an item 2.00'
+        assert smart.format(format_string, 2, 3) == u'2 items 3.00'
+        stats = {(s.kind, s.key): s for s in profiler.stats()}
+        assert stats['parse', format_string].count == 1
+        assert stats['render', format_string].count == 2
+        assert stats['extension', u'plural'].count == 2
+        assert stats['format_field', u'n2'].count == 2
+        assert all(s.total >= 0 for s in stats.values())
+        assert set(s.kind for s in profiler.stats('parse')) == set(['parse'])
+        profiler.clear()
+        assert profiler.stats() == []
+
+    def test_eval_extensions(self):
+        profiler = Profiler()
+        smart = SmartFormatter('en_US', profiler=profiler)
+        assert smart.eval_extensions(1, u'', None, u'one|many') == u'one'
+        stat, = profiler.stats('eval_extensions')
+        assert stat.key == u''
+        assert stat.count == 1
+
+    def test_eval_extensions_in_render(self):
+        profiler = Profiler()
+        smart = SmartFormatter('en_US', profiler=profiler)
+        assert smart.format(u'{0:item|items} {1:list:{}|, }', 2, [1, 2]) == \
+            u'items 1, 2'
+        assert u''.join(smart.iter_render(u'{0:item|items}', 1)) == u'item'
+        stats = dict((stat.key, stat.count)
+                     for stat in profiler.stats('eval_extensions'))
+        # The items of the list are formatted by the nested `{}`.
+        assert stats == {u'': 4, u'list': 1}
+
+    def test_set_profiler(self):
+        smart = SmartFormatter('en_US')
+        assert smart.profiler is None
+        template = smart.compile(u'{0:item|items}')
+        profiler = Profiler()
+        smart.set_profiler(profiler)
+        assert smart.compile(u'{0:item|items}') is not template
+        assert smart.format(u'{0:item|items}', 2) == u'items'
+        assert len(profiler.stats('extension')) == 1
+        smart.set_profiler(None)
+        smart.format(u'{0:item|items}', 2)
+        assert profiler.stats('extension')[0].count == 1
+
+
+class TestMemoize(TestSmartFormatter):
+
+    def test_memoize(self):
+        smart = SmartFormatter('en_US', result_cache_size=16)
+        format_string = \
+            u'{gender:c(male|female):He|She} got {n:an item|{} items}.'
+        template = smart.compile(format_string)
+        assert template.pure
+        assert smart.format(format_string, gender=u'male', n=1) == \
+            u'He got an item.'
+        assert smart.format(format_string, gender=u'male', n=1) == \
+            u'He got an item.'
+        info = smart.result_cache_info()
+        assert info.hits == 1
+        assert smart.format(format_string, gender=u'female', n=2) == \
+            u'She got 2 items.'
+        # Equal values which are formatted differently.
+        assert smart.format(u'{0}', 1) == u'1'
+        assert smart.format(u'{0}', 1.0) == u'1.0'
+        assert smart.format(u'{0}', True) == u'True'
+        assert smart.format(u'{0}', 0.0) == u'0.0'
+        assert smart.format(u'{0}', -0.0) == u'-0.0'
+        assert smart.format(u'{0}', Decimal('1.0')) == u'1.0'
+        assert smart.format(u'{0}', Decimal('1.00')) == u'1.00'
+        assert smart.format(u'{0:{}|, }', (1, 2)) == u'1, 2'
+        assert smart.format(u'{0:{}|, }', (1.0, 2)) == u'1.0, 2'
+        # Mutable arguments.
+        assert smart.format(u'{0:{}|, }', [1, 2]) == u'1, 2'
+        assert smart.format(u'{0:{}|, }', [1, 2, 3]) == u'1, 2, 3'
+        # Another locale.
+        ko = smart.with_locale('ko_KR')
+        assert ko.format(u'{0:n1}', 1234) == u'1,234.0'
+        assert smart.with_locale('ru_RU').format(u'{0:n1}', 1234) == \
+            u'1\xa0234,0'
+        smart.cache_clear()
+        assert smart.result_cache_info().currsize == 0
+
+    def test_mutable(self):
+        class Point(object):
+            def __init__(self, x):
+                self.x = x
+            __hash__ = object.__hash__
+        smart = SmartFormatter('en_US', result_cache_size=16)
+        point = Point(1)
+        assert smart.format(u'{0.x}', point) == u'1'
+        point.x = 2
+        assert smart.format(u'{0.x}', point) == u'2'
+        assert smart.format(u'{0[0].x}', (point,)) == u'2'
+        point.x = 3
+        assert smart.format(u'{0[0].x}', (point,)) == u'3'
+        assert smart.result_cache_info().currsize == 0
+
+    def test_disabled(self):
+        smart = SmartFormatter('en_US')
+        assert smart.result_cache_info() is None
+        assert smart.format(u'{0:item|items}', 1) == u'item'
+
+    def test_impure(self):
+        calls = []
+
+        @extension(['hello'])
+        def hello(formatter, value, name, option, format):
+            calls.append(value)
+            return u'HELLO'
+        smart = SmartFormatter('en_US', [hello], result_cache_size=16)
+        template = smart.compile(u'{0:hello:}')
+        assert not template.pure
+        # Nested templates.
+        template = smart.compile(u'{0:{:hello:}|, }')
+        assert not template.pure
+        assert smart.compile(u'{0:{}|, }').pure
+        template.render((1, 2))
+        template.render((1, 2))
+        assert calls == [1, 2, 1, 2]
+        # Enable the memoization for a format string.
+        smart.set_memoize(u'{0:{:hello:}|, }', True)
+        smart.format(u'{0:{:hello:}|, }', (1, 2))
+        template.render((1, 2))
+        # Also for rebuilt templates and other locales.
+        smart.cache_clear()
+        smart.compile(u'{0:{:hello:}|, }').render((1, 2))
+        smart.with_locale('ko_KR').format(u'{0:{:hello:}|, }', (1, 2))
+        assert calls == [1, 2, 1, 2, 1, 2, 1, 2, 1, 2]
+        # Disable.
+        smart.set_memoize(u'{0:item|items}', False)
+        smart.register([])
+        smart.format(u'{0:item|items}', 1)
+        smart.with_locale('ko_KR').format(u'{0:item|items}', 1)
+        assert smart.result_cache_info().currsize == 0
+        smart.set_memoize(u'{0:item|items}', None)
+        smart.format(u'{0:item|items}', 1)
+        assert smart.result_cache_info().currsize == 1
+
+
+class TestParallel(TestSmartFormatter):
+
+    def test_format_parallel(self):
+        smart = SmartFormatter('ru_RU', errors='ignore')
+        format_string = u'{0} {0:банан|банана|бананов}{1:__:} {2:{}|-}'
+        rows = [(x, x, [x, x]) for x in range(100)]
+        expected = smart.format_many(format_string, rows)
+        results = smart.format_parallel(format_string, rows,
+                                        max_workers=2, chunk_size=7)
+        assert results == expected
+        assert results[2] == u'2 банана 2-2'
+        rows = [{'n': x} for x in range(10)]
+        results = smart.iformat_parallel(u'{n:n1}', rows, 2, 3)
+        assert list(results) == [u'%d,0' % x for x in range(10)]
+
+    def test_subclass(self):
+        smart = DefaultFormatter('en_US')
+        rows = [(x,) for x in range(10)]
+        expected = smart.format_many(u'{0} {missing}', rows)
+        assert expected[0] == u'0 ?'
+        results = smart.format_parallel(u'{0} {missing}', rows,
+                                        max_workers=2, chunk_size=3)
+        assert results == expected
+        assert get_config(smart)['class'] == 'test:DefaultFormatter'
+
+    def test_unimportable_class(self):
+        class UnimportableFormatter(DefaultFormatter):
+            pass
+
+        smart = UnimportableFormatter('en_US')
+        assert get_config(smart) is None
+        results = smart.format_parallel(u'{0} {missing}', [(1,), (2,)],
+                                        max_workers=2)
+        assert results == [u'1 ?', u'2 ?']
+
+    def test_fallback(self):
+        @extension(['hello'])
+        def hello(formatter, value, name, option, format):
+            return u'HELLO'
+        smart = SmartFormatter('en_US', [hello])
+        rows = [(x,) for x in range(10)]
+        results = smart.format_parallel(u'{0:hello:}', rows, max_workers=2)
+        assert results == [u'HELLO'] * 10
+        results = smart.format_parallel(u'{0}', rows, max_workers=1)
+        assert results == [u'%d' % x for x in range(10)]
+
+    def test_error(self):
+        smart = SmartFormatter('en_US')
+        with pytest.raises(ValueError):
+            smart.format_parallel(u'{0:__:}', [(1,)], max_workers=2)